@@ -0,0 +1,424 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Scalability benchmarks on synthetic data
+
+A scenario describes a synthetic dataset (number of samples, read depth,
+reference length and number of contigs) and the config.yaml values of the
+analysis (see :data:`SCENARIOS`). The reference, the known variants
+(truth.vcf) and the paired reads of each sample are generated offline with
+a fixed seed (see :func:`generate_dataset`). The pipeline is then run on
+the dataset and the Snakemake benchmark files (benchmarks/ directory) are
+summarised by rule (see :func:`collect_benchmarks`)::
+
+    sequana_variant_calling_benchmark --scenario small --scenario samples \\
+        --working-directory bench --save-baseline baseline.json
+    # later, with another version of the pipeline
+    sequana_variant_calling_benchmark --scenario small --scenario samples \\
+        --working-directory bench2 --baseline baseline.json
+
+Rules slower (or using more memory or disk) than the baseline by more than
+the tolerance are reported (see :func:`compare_to_baseline`).
+
+"""
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import rich_click as click
+
+# default values of the scenarios
+DEFAULT_SCENARIO = {
+    "samples": 2,
+    "depth": 20,
+    "reference_length": 200000,
+    "contigs": 1,
+    "read_length": 100,
+    "insert_size": 300,
+    "variant_rate": 0.001,
+    "seed": 1,
+    "config": {},
+}
+
+SCENARIOS = {
+    "small": {},
+    "samples": {"samples": 24},
+    "depth": {"depth": 200},
+    "reference": {"reference_length": 20000000, "depth": 10},
+    "contigs": {"reference_length": 2000000, "contigs": 2000},
+    "chunksize": {"reference_length": 2000000, "config": {"freebayes": {"chunksize": 10000}}},
+    "bwa_split": {"depth": 50, "config": {"general": {"aligner_choice": "bwa_split"}, "bwa_split": {"nreads": 20000}}},
+    "coverage": {"reference_length": 2000000, "config": {"sequana_coverage": {"do": True}}},
+}
+
+# metrics compared to the baseline (summed over the jobs of a rule except max_rss)
+METRICS = ["wall", "cpu", "max_rss", "io_out"]
+
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+
+def get_scenario(name, **params):
+    """Return the parameters of a scenario (see :data:`SCENARIOS`) updated with params"""
+    scenario = dict(DEFAULT_SCENARIO, **SCENARIOS[name])
+    scenario.update(params)
+    return scenario
+
+
+def generate_reference(length, contigs=1, seed=0):
+    """Return random contigs ({name: sequence}) of a reference of the given length"""
+    rng = np.random.default_rng(seed)
+    sizes = np.full(contigs, length // contigs)
+    sizes[: length % contigs] += 1
+    bases = np.frombuffer(b"ACGT", dtype="S1")
+    return {f"contig{i + 1}": bases[rng.integers(0, 4, size)].tobytes().decode() for i, size in enumerate(sizes)}
+
+
+def generate_variants(sequences, rate=0.001, seed=0):
+    """Return random SNPs (chrom, position (0-based), ref, alt) sorted by position"""
+    rng = np.random.default_rng(seed)
+    variants = []
+    for chrom, sequence in sequences.items():
+        positions = np.sort(rng.choice(len(sequence), int(len(sequence) * rate), replace=False))
+        for position in positions:
+            ref = sequence[position]
+            alt = "ACGT".replace(ref, "")[rng.integers(0, 3)]
+            variants.append((chrom, int(position), ref, alt))
+    return variants
+
+
+def apply_variants(sequences, variants):
+    """Return the sequences with the SNPs"""
+    sequences = {chrom: bytearray(sequence.encode()) for chrom, sequence in sequences.items()}
+    for chrom, position, _, alt in variants:
+        sequences[chrom][position] = ord(alt)
+    return {chrom: sequence.decode() for chrom, sequence in sequences.items()}
+
+
+def simulate_reads(sequences, prefix, depth, read_length=100, insert_size=300, error_rate=0.001, seed=0):
+    """Save paired reads of the sequences ({prefix}_R1_.fastq.gz and {prefix}_R2_.fastq.gz)
+
+    Fragments are taken uniformly on both strands (contigs must be longer
+    than the reads). Sequencing errors are substitutions with a uniform rate.
+
+    :return: the number of pairs
+    """
+    rng = np.random.default_rng(seed)
+    names = list(sequences)
+    lengths = np.array([len(sequences[x]) for x in names])
+    npairs = int(depth * lengths.sum() / (2 * read_length))
+    contigs = rng.choice(len(names), npairs, p=lengths / lengths.sum())
+    quality = "I" * read_length
+    name = os.path.basename(prefix)
+
+    def mutate(read):
+        nerrors = rng.binomial(read_length, error_rate)
+        if not nerrors:
+            return read
+        read = list(read)
+        for position in rng.integers(0, read_length, nerrors):
+            read[position] = "ACGT"[rng.integers(0, 4)]
+        return "".join(read)
+
+    with gzip.open(f"{prefix}_R1_.fastq.gz", "wt", compresslevel=1) as fout1:
+        with gzip.open(f"{prefix}_R2_.fastq.gz", "wt", compresslevel=1) as fout2:
+            for i, contig in enumerate(contigs):
+                sequence = sequences[names[contig]]
+                fragment = min(insert_size, len(sequence))
+                start = rng.integers(0, len(sequence) - fragment + 1)
+                r1 = sequence[start : start + read_length]
+                r2 = sequence[start + fragment - read_length : start + fragment].translate(COMPLEMENT)[::-1]
+                if rng.random() < 0.5:
+                    r1, r2 = r2, r1
+                fout1.write(f"@{name}.{i}/1\n{mutate(r1)}\n+\n{quality}\n")
+                fout2.write(f"@{name}.{i}/2\n{mutate(r2)}\n+\n{quality}\n")
+    return npairs
+
+
+def write_fasta(sequences, output, width=80):
+    with open(output, "w") as fout:
+        for chrom, sequence in sequences.items():
+            fout.write(f">{chrom}\n")
+            for i in range(0, len(sequence), width):
+                fout.write(sequence[i : i + width] + "\n")
+
+
+def write_truth(sequences, variants, genotypes, output):
+    """Save the known variants in a VCF file (haploid genotypes of the samples)
+
+    :param genotypes: dictionary with the set of variants (indices) of each sample
+    """
+    samples = sorted(genotypes)
+    with open(output, "w") as fout:
+        fout.write("##fileformat=VCFv4.2\n")
+        for chrom, sequence in sequences.items():
+            fout.write(f"##contig=<ID={chrom},length={len(sequence)}>\n")
+        fout.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        fout.write(
+            "\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + samples) + "\n"
+        )
+        for i, (chrom, position, ref, alt) in enumerate(variants):
+            gts = ["1" if i in genotypes[x] else "0" for x in samples]
+            fout.write(f"{chrom}\t{position + 1}\t.\t{ref}\t{alt}\t.\tPASS\t.\tGT\t" + "\t".join(gts) + "\n")
+
+
+def generate_dataset(directory, scenario):
+    """Save the reference, the known variants and the reads of a scenario
+
+    Files are reference.fa, truth.vcf and the paired reads of the samples
+    (S1_R1_.fastq.gz, ...). Each sample carries each variant with a
+    probability of 0.5. Nothing is done if the dataset of the same scenario
+    already exists (dataset.json, saved last). Otherwise, the directory is
+    removed and the dataset generated again.
+
+    :return: the directory
+    """
+    params = {key: value for key, value in scenario.items() if key != "config"}
+    manifest = f"{directory}/dataset.json"
+    if os.path.exists(manifest):
+        with open(manifest) as fin:
+            if json.load(fin) == params:
+                return directory
+
+    if params["reference_length"] // params["contigs"] < params["read_length"]:
+        raise ValueError("contigs must be longer than the reads")
+
+    # files of another scenario (or of an interrupted run) are not kept
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    seed = params["seed"]
+    sequences = generate_reference(params["reference_length"], params["contigs"], seed=seed)
+    variants = generate_variants(sequences, params["variant_rate"], seed=seed)
+    write_fasta(sequences, f"{directory}/reference.fa")
+
+    rng = np.random.default_rng(seed)
+    genotypes = {}
+    for i in range(params["samples"]):
+        sample = f"S{i + 1}"
+        genotypes[sample] = {j for j in range(len(variants)) if rng.random() < 0.5}
+        haplotype = apply_variants(sequences, [x for j, x in enumerate(variants) if j in genotypes[sample]])
+        simulate_reads(
+            haplotype,
+            f"{directory}/{sample}",
+            params["depth"],
+            read_length=params["read_length"],
+            insert_size=params["insert_size"],
+            seed=seed + i + 1,
+        )
+    write_truth(sequences, variants, genotypes, f"{directory}/truth.vcf")
+
+    with open(manifest, "w") as fout:
+        json.dump(params, fout, indent=4)
+    return directory
+
+
+def collect_benchmarks(directory):
+    """Summarise the Snakemake benchmark files ({rule}/{wildcards}.tsv) by rule
+
+    :return: dictionary with the number of jobs, the wall time (s), CPU time
+        (s) and data written (MB) of all jobs, the longest job (s) and the
+        largest memory used (MB) of each rule.
+    """
+    import glob
+
+    from sequana_pipelines.variant_calling.planner import read_benchmark_record
+
+    results = {}
+    for filename in sorted(glob.glob(f"{directory}/*/**/*.tsv", recursive=True)):
+        rule = os.path.relpath(filename, directory).split(os.sep)[0]
+        record = read_benchmark_record(filename)
+        stats = results.setdefault(rule, {"jobs": 0, "wall": 0, "max_wall": 0, "cpu": 0, "max_rss": 0, "io_out": 0})
+        stats["jobs"] += 1
+        stats["wall"] += record.get("s") or 0
+        stats["max_wall"] = max(stats["max_wall"], record.get("s") or 0)
+        stats["cpu"] += record.get("cpu_time") or 0
+        stats["max_rss"] = max(stats["max_rss"], record.get("max_rss") or 0)
+        stats["io_out"] += record.get("io_out") or 0
+    return {rule: {key: round(value, 2) for key, value in stats.items()} for rule, stats in results.items()}
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_values=None):
+    """Return the rules of the results above the baseline
+
+    :param results: benchmarks by rule (see :func:`collect_benchmarks`)
+    :param baseline: benchmarks by rule of the reference version
+    :param tolerance: relative increase of a metric above which a rule is
+        reported
+    :param min_values: differences below these values are ignored (noise of
+        short jobs). Default to 1s (wall and CPU time) and 10MB (memory and
+        data written).
+    :return: list of (rule, metric, baseline value, value) sorted by rule
+    """
+    min_values = min_values or {"wall": 1, "cpu": 1, "max_rss": 10, "io_out": 10}
+    regressions = []
+    for rule in sorted(set(results) & set(baseline)):
+        for metric in METRICS:
+            value, reference = results[rule].get(metric, 0), baseline[rule].get(metric, 0)
+            if value - reference > max(tolerance * reference, min_values.get(metric, 0)):
+                regressions.append((rule, metric, reference, value))
+    return regressions
+
+
+def update_config(config, overrides):
+    """Update a (nested) config dictionary with the values of overrides"""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            update_config(config[key], value)
+        else:
+            config[key] = value
+    return config
+
+
+def run_scenario(name, scenario, directory, cores=4, until=(), options=()):
+    """Run the pipeline on the dataset of a scenario
+
+    The dataset is saved in {directory}/{name}/data (kept for the next runs)
+    and the analysis in {directory}/{name}/run (removed before the run).
+
+    :param until: run the pipeline up to these rules only (snakemake --until)
+    :param options: other snakemake options
+    :return: dictionary with the scenario, the makespan (s) and the benchmarks by rule
+    """
+    import yaml
+
+    data = generate_dataset(f"{directory}/{name}/data", scenario)
+    workdir = f"{directory}/{name}/run"
+    shutil.rmtree(workdir, ignore_errors=True)
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "sequana_pipelines.variant_calling.main",
+            "--input-directory",
+            data,
+            "--working-directory",
+            workdir,
+            "--reference-file",
+            f"{data}/reference.fa",
+            "--force",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    with open(f"{workdir}/config.yaml") as fin:
+        config = yaml.safe_load(fin)
+    with open(f"{workdir}/config.yaml", "w") as fout:
+        yaml.safe_dump(update_config(config, scenario["config"]), fout, sort_keys=False)
+
+    cmd = ["snakemake", "-s", "variant_calling.rules", "--cores", str(cores)]
+    if until:
+        cmd += ["--until"] + list(until)
+    start = time.time()
+    subprocess.run(cmd + list(options), cwd=workdir, check=True)
+    makespan = time.time() - start
+
+    return {
+        "scenario": scenario,
+        "makespan": round(makespan, 1),
+        "rules": collect_benchmarks(f"{workdir}/benchmarks"),
+    }
+
+
+def parse_value(text):
+    """Return the value of a key=value option (YAML syntax)"""
+    import yaml
+
+    key, value = text.split("=", 1)
+    return key, yaml.safe_load(value)
+
+
+@click.command()
+@click.option(
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    default=["small"],
+    show_default=True,
+    type=click.Choice(list(SCENARIOS)),
+    help="Scenarios to run (several can be given)",
+)
+@click.option(
+    "--working-directory", default="benchmark", show_default=True, help="Directory of the datasets and analyses"
+)
+@click.option("--cores", default=4, show_default=True, help="Number of cores of the analyses")
+@click.option("--until", multiple=True, help="Run the pipeline up to this rule only (several can be given)")
+@click.option(
+    "--param",
+    "params",
+    multiple=True,
+    help="Change a parameter of the scenarios (e.g. depth=50 or samples=8, see DEFAULT_SCENARIO)",
+)
+@click.option("--set", "settings", multiple=True, help="Change a config.yaml value (e.g. freebayes.chunksize=50000)")
+@click.option("--baseline", help="Compare the results to this file (JSON file saved with --save-baseline)")
+@click.option("--tolerance", default=0.25, show_default=True, help="Relative increase reported as a regression")
+@click.option("--save-baseline", help="Save the results in this file")
+def main(scenarios, working_directory, cores, until, params, settings, baseline, tolerance, save_baseline):
+    """Run the pipeline on synthetic datasets and report the resources of each rule
+
+    Wall time, CPU time, memory (max RSS) and data written by each rule are
+    read from the Snakemake benchmark files. With --baseline, the rules above
+    the baseline are reported (and the exit code is 1).
+    """
+    overrides = {}
+    for setting in settings:
+        key, value = parse_value(setting)
+        *sections, key = key.split(".")
+        nested = {key: value}
+        for section in reversed(sections):
+            nested = {section: nested}
+        update_config(overrides, nested)
+
+    results = {}
+    for name in scenarios:
+        scenario = get_scenario(name, **dict(parse_value(x) for x in params))
+        scenario["config"] = update_config(json.loads(json.dumps(scenario["config"])), overrides)
+        click.echo(f"Scenario {name}: {scenario}")
+        results[name] = run_scenario(name, scenario, working_directory, cores=cores, until=until)
+
+        click.echo(f"Makespan: {results[name]['makespan']}s")
+        click.echo(f"{'rule':<30}{'jobs':>6}{'wall(s)':>12}{'max(s)':>10}{'cpu(s)':>12}{'rss(MB)':>10}{'out(MB)':>10}")
+        for rule, stats in sorted(results[name]["rules"].items()):
+            click.echo(
+                f"{rule:<30}{stats['jobs']:>6}{stats['wall']:>12}{stats['max_wall']:>10}"
+                f"{stats['cpu']:>12}{stats['max_rss']:>10}{stats['io_out']:>10}"
+            )
+
+    with open(f"{working_directory}/results.json", "w") as fout:
+        json.dump(results, fout, indent=4)
+    if save_baseline:
+        with open(save_baseline, "w") as fout:
+            json.dump(results, fout, indent=4)
+
+    if baseline:
+        with open(baseline) as fin:
+            reference = json.load(fin)
+        regressions = []
+        for name in results:
+            if name in reference:
+                for rule, metric, before, after in compare_to_baseline(
+                    results[name]["rules"], reference[name]["rules"], tolerance=tolerance
+                ):
+                    regressions.append(f"{name}: {rule} {metric} {before} -> {after}")
+        for regression in regressions:
+            click.echo(f"Regression {regression}")
+        if regressions:
+            sys.exit(1)
+        click.echo("No regression")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Content-addressed cache of reference indexes shared between projects
+
+Indexes (bwa, samtools faidx, ...) only depend on the content of the reference
+and on the indexing parameters. They are saved in a cache directory as
+``{directory}/{kind}/{key}/`` where the key is a SHA-256 of the input files
+and of the parameters (see :func:`get_cache_key`)::
+
+    cache = IndexCache("/shared/cache", max_size=100)
+    key = get_cache_key(["ref.fa"], algorithm="is")
+    files = {"bwt": "ref.fa.bwt", "fai": "ref.fa.fai"}
+    with cache.lock("bwa", key):
+        if not cache.fetch("bwa", key, files):
+            # build the files here
+            cache.store("bwa", key, files)
+    cache.evict(keep=[("bwa", key)])
+
+An entry is populated by a single process: an exclusive lock (fcntl) is
+held on ``{key}.lock`` and files are copied in a temporary directory renamed
+into the entry, so that an entry is either complete or absent. Cached files
+are hard-linked into the project (or copied across file systems) so that a
+project never depends on the cache once its files are fetched. Cached
+directories (e.g. snpEff database) are re-created in the project with their
+files hard-linked (or copied) in the same way.
+
+A hard link shares its modification time with the cache entry and with the
+other projects: linked files keep the time of the entry (older than the
+project's files) and must be declared with ``ancient()`` in the rules.
+
+When the size of the cache exceeds *max_size*, the least recently used
+entries are removed. Entries being populated (locked) and entries whose files
+are hard-linked in a project (link count above 1) are never removed: removing
+them would not free any space.
+
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+def get_cache_key(filenames, **params):
+    """Return a SHA-256 of the files' content and of the parameters
+
+    File names are not used so that the same reference saved under
+    different names shares the same key.
+    """
+    sha = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, "rb") as fin:
+            for chunk in iter(lambda: fin.read(2**20), b""):
+                sha.update(chunk)
+        sha.update(b"\0")
+    sha.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+def _link_file(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        # different file systems. The copy is newer than the project's
+        # reference (a hard link shares its time with the cache and the
+        # other projects and must not be touched)
+        shutil.copy(source, target)
+        os.utime(target)
+
+
+def _link(source, target):
+    if os.path.isdir(target) and not os.path.islink(target):
+        shutil.rmtree(target)
+    elif os.path.lexists(target):
+        os.remove(target)
+    if os.path.isdir(source):
+        shutil.copytree(source, target, copy_function=_link_file)
+        os.utime(target)
+    else:
+        _link_file(source, target)
+
+
+def _is_linked(path):
+    """Return True if a file of the directory is hard-linked elsewhere"""
+    for root, _, files in os.walk(path):
+        for name in files:
+            if os.stat(os.path.join(root, name), follow_symlinks=False).st_nlink > 1:
+                return True
+    return False
+
+
+def _get_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            filename = os.path.join(root, name)
+            if not os.path.islink(filename):
+                total += os.path.getsize(filename)
+    return total
+
+
+class IndexCache:
+    """Shared cache of index files
+
+    :param directory: the cache directory (created if needed)
+    :param max_size: maximum size of the cache in GB. No limit if 0 or None.
+    """
+
+    def __init__(self, directory, max_size=0):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_entry(self, kind, key):
+        """Return the directory of an entry"""
+        return os.path.join(self.directory, kind, key)
+
+    @contextmanager
+    def lock(self, kind, key, shared=False):
+        """Exclusive (or shared) lock on an entry"""
+        os.makedirs(os.path.join(self.directory, kind), exist_ok=True)
+        with open(self.get_entry(kind, key) + ".lock", "a") as fout:
+            fcntl.flock(fout, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fout, fcntl.LOCK_UN)
+
+    def fetch(self, kind, key, files):
+        """Link the cached files into the project
+
+        :param files: dictionary with the names of the files in the cache as
+            keys and the project filenames as values.
+        :return: True if the entry exists, False otherwise.
+        """
+        entry = self.get_entry(kind, key)
+        if not all(os.path.exists(os.path.join(entry, name)) for name in files):
+            return False
+        for name, target in files.items():
+            _link(os.path.join(entry, name), target)
+        # used to remove the least recently used entries
+        os.utime(entry)
+        return True
+
+    def store(self, kind, key, files):
+        """Save files in the cache (see :meth:`fetch`)"""
+        entry = self.get_entry(kind, key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(entry)) as tmpdir:
+            tmp_entry = os.path.join(tmpdir, key)
+            os.makedirs(tmp_entry)
+            for name, source in files.items():
+                if os.path.isdir(source):
+                    shutil.copytree(source, os.path.join(tmp_entry, name))
+                else:
+                    shutil.copy(source, os.path.join(tmp_entry, name))
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            os.rename(tmp_entry, entry)
+
+    def get_entries(self):
+        """Return list of (kind, key) of all entries"""
+        entries = []
+        for kind in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, kind)
+            if os.path.isdir(path):
+                for key in os.listdir(path):
+                    if os.path.isdir(os.path.join(path, key)) and not key.startswith("tmp"):
+                        entries.append((kind, key))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_size
+
+        Entries linked in a project (see :func:`_is_linked`) are kept.
+
+        :param keep: list of (kind, key) entries that are not removed.
+        :return: list of removed entries
+        """
+        if not self.max_size:
+            return []
+
+        keep = set(keep or [])
+        entries = {entry: _get_size(self.get_entry(*entry)) for entry in self.get_entries()}
+        total = sum(entries.values())
+        limit = self.max_size * 1024**3
+
+        removed = []
+        for entry in sorted(entries, key=lambda x: os.path.getmtime(self.get_entry(*x))):
+            if total <= limit:
+                break
+            if entry in keep:
+                continue
+            lockfile = self.get_entry(*entry) + ".lock"
+            with open(lockfile, "a") as fout:
+                try:
+                    fcntl.flock(fout, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # in use by another process
+                    continue
+                if _is_linked(self.get_entry(*entry)):
+                    # used by a project
+                    fcntl.flock(fout, fcntl.LOCK_UN)
+                    continue
+                shutil.rmtree(self.get_entry(*entry), ignore_errors=True)
+                fcntl.flock(fout, fcntl.LOCK_UN)
+            total -= entries[entry]
+            removed.append(entry)
+        return removed
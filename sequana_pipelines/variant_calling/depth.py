@@ -0,0 +1,278 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Per-base depth of coverage for sequana_coverage
+
+The sequana_coverage input is a 4-columns file (contig, position, depth,
+depth) where the two depths are those reported by:
+
+- samtools depth -aa: reads flagged as unmapped, secondary, QC fail or
+  duplicates are ignored. Deletions and reference skips are not counted.
+- bedtools genomecov -d: all mapped reads are used. The whole span of the
+  reads is counted (deletions and reference skips included).
+
+Both depths are computed here in a single pass over the BAM file. Aligned
+blocks of the reads are accumulated as start/end events. The reads being
+sorted, the depth of the positions before the start of a read is final: it
+is computed by chunks of positions from the sorted events (numpy arrays) so
+that the memory does not depend on the length of the contigs. Positions are
+reported for all contigs of the reference (FASTA index order). CRAM files
+are decoded with the reference FASTA file (*reference* parameter).
+
+"""
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+
+from sequana_pipelines.variant_calling.regions import read_fai
+
+# flags ignored by samtools depth (UNMAP, SECONDARY, QCFAIL, DUP)
+SAMTOOLS_EXCLUDED_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+# CIGAR operations
+_MATCH_OPS = {0, 7, 8}  # M, =, X
+_DELETION = 2
+_REF_SKIP = 3
+
+# number of positions of the depth chunks
+_CHUNKSIZE = 2**16
+
+
+class _DepthAccumulator:
+    """Accumulate aligned blocks of a contig and yield both depths by chunks
+
+    Reads must be added by increasing start (sorted file). Events after the
+    last chunk are kept in lists until the next call to :meth:`flush`.
+    """
+
+    def __init__(self, length, chunksize=None):
+        self.length = length
+        self.chunksize = chunksize or _CHUNKSIZE
+        # first position not yet yielded. The events before this position
+        # are summed in self.depths (blocks started minus blocks ended)
+        self.offset = 0
+        self.depths = [0, 0]
+        self.events = [([], []), ([], [])]
+
+    def add_read(self, read):
+        if read.reference_start < self.offset:
+            raise ValueError("the BAM file must be sorted by coordinates")
+        if not read.flag & SAMTOOLS_EXCLUDED_FLAGS:
+            pos = read.reference_start
+            for op, size in read.cigartuples:
+                if op in _MATCH_OPS:
+                    self._add(0, pos, pos + size)
+                if op in _MATCH_OPS or op == _DELETION or op == _REF_SKIP:
+                    pos += size
+        self._add(1, read.reference_start, read.reference_end)
+
+    def _add(self, index, start, end):
+        starts, ends = self.events[index]
+        starts.append(start)
+        ends.append(min(end, self.length))
+
+    def is_full(self, position):
+        """Return True if a chunk can be yielded before this read start"""
+        return position >= self.offset + self.chunksize
+
+    def flush(self, position=None):
+        """Yield (start, depth1, depth2) chunks of the positions before *position*
+
+        :param position: start of the next read (end of the contig by default)
+        """
+        end = self.length if position is None else min(position, self.length)
+        if end <= self.offset:
+            return
+
+        events = []
+        for index, (starts, ends) in enumerate(self.events):
+            starts, ends = np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+            # events after the last chunk are kept
+            self.events[index] = (starts[starts >= end].tolist(), ends[ends >= end].tolist())
+            events.append((np.sort(starts[starts < end]), np.sort(ends[ends < end])))
+
+        for start in range(self.offset, end, self.chunksize):
+            positions = np.arange(start, min(start + self.chunksize, end))
+            # depth of a position: blocks started minus blocks ended at or before it
+            depth1, depth2 = (
+                (
+                    self.depths[index]
+                    + np.searchsorted(starts, positions, side="right")
+                    - np.searchsorted(ends, positions, side="right")
+                ).astype(np.int32)
+                for index, (starts, ends) in enumerate(events)
+            )
+            yield start, depth1, depth2
+
+        for index, (starts, ends) in enumerate(events):
+            self.depths[index] += len(starts) - len(ends)
+        self.offset = end
+
+
+def write_depths(fout, name, depth1, depth2, max_depth=None, start=0):
+    """Write the 4-columns depth file for a chunk of a contig
+
+    :param start: 0-based position of the first depth
+    """
+    if max_depth:
+        depth1 = np.minimum(depth1, max_depth)
+    positions = range(start + 1, start + len(depth1) + 1)
+    # much faster than numpy.savetxt
+    fout.write("".join(f"{name}\t{pos}\t{x}\t{y}\n" for pos, x, y in zip(positions, depth1.tolist(), depth2.tolist())))
+
+
+def get_index_name(bamfile):
+    """Return the name of the BAM (.bai) or CRAM (.crai) index"""
+    return bamfile + (".crai" if bamfile.endswith(".cram") else ".bai")
+
+
+def iter_contig_depths(bamfile, name, length, reference=None):
+    """Yield (start, depth1, depth2) chunks of a contig (BAM/CRAM file must be indexed)"""
+    import pysam
+
+    accumulator = _DepthAccumulator(length)
+    with pysam.AlignmentFile(bamfile, reference_filename=reference) as bam:
+        if name in bam.references:
+            for read in bam.fetch(name):
+                if read.is_unmapped or not read.cigartuples:
+                    continue
+                if accumulator.is_full(read.reference_start):
+                    yield from accumulator.flush(read.reference_start)
+                accumulator.add_read(read)
+    yield from accumulator.flush()
+
+
+def _write_contig(args):
+    bamfile, name, length, filename, max_depth, reference = args
+    with open(filename, "w") as fout:
+        for start, depth1, depth2 in iter_contig_depths(bamfile, name, length, reference=reference):
+            write_depths(fout, name, depth1, depth2, max_depth=max_depth, start=start)
+    return filename
+
+
+def create_double_bed(bamfile, fai, output, threads=1, max_depth=None, reference=None):
+    """Create the depth file used by sequana_coverage
+
+    :param bamfile: sorted BAM or CRAM file
+    :param fai: the reference FASTA index
+    :param output: the 4-columns output file
+    :param threads: if more than 1, contigs are processed in parallel. This
+        requires the BAM (or CRAM) index: without index, the file is read in
+        a single pass. The index is never created here (the BAM file belongs
+        to another job).
+    :param max_depth: cap the depth of the first column (samtools -m option)
+    :param reference: the reference FASTA file (required for CRAM files)
+    """
+    contigs = read_fai(fai)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as tmpdir:
+        if threads > 1 and len(contigs) > 1 and os.path.exists(get_index_name(bamfile)):
+            tasks = [
+                (bamfile, name, length, f"{tmpdir}/{i}.bed", max_depth, reference)
+                for i, (name, length) in enumerate(contigs)
+            ]
+            # largest contigs first for a better load balance
+            tasks = sorted(tasks, key=lambda x: -x[2])
+            with Pool(threads) as pool:
+                pool.map(_write_contig, tasks, chunksize=1)
+            with open(output, "w") as fout:
+                for i in range(len(contigs)):
+                    with open(f"{tmpdir}/{i}.bed") as fin:
+                        shutil.copyfileobj(fin, fout)
+            return
+
+        # contigs are read in the order of the BAM header. Contigs read before
+        # their turn in the FASTA index order are saved in temporary files.
+        order = {name: i for i, (name, _) in enumerate(contigs)}
+        done = [False] * len(contigs)
+        written = 0
+
+        with open(output, "w") as fout:
+
+            def complete(index):
+                # write the complete contigs that are next in order
+                nonlocal written
+                done[index] = True
+                while written < len(contigs) and done[written]:
+                    filename = f"{tmpdir}/{written}.bed"
+                    if os.path.exists(filename):
+                        with open(filename) as fin:
+                            shutil.copyfileobj(fin, fout)
+                        os.remove(filename)
+                    written += 1
+
+            current, fcontig = None, None
+            for name, start, depth1, depth2 in iter_depths(bamfile, contigs, reference=reference):
+                if order[name] != current:
+                    if current is not None:
+                        if fcontig is not fout:
+                            fcontig.close()
+                        complete(current)
+                    current = order[name]
+                    fcontig = fout if current == written else open(f"{tmpdir}/{current}.bed", "w")
+                write_depths(fcontig, name, depth1, depth2, max_depth=max_depth, start=start)
+            if current is not None and fcontig is not fout:
+                fcontig.close()
+            # including the empty contigs (no position)
+            for index in range(len(contigs)):
+                complete(index)
+
+
+def iter_depths(bamfile, contigs, reference=None):
+    """Yield (name, start, depth1, depth2) chunks of all contigs in a single pass
+
+    The BAM file being sorted, the depths before the start of a read are final
+    (see :class:`_DepthAccumulator`) and a contig is complete when the reads of
+    the next one are reached. Contigs are yielded in the order of the BAM
+    header (contigs without reads included), then the contigs of *contigs*
+    that are not in the header. No BAM index is required.
+
+    :param bamfile: sorted BAM or CRAM file
+    :param contigs: list of (name, length) (see :func:`read_fai`)
+    :param reference: the reference FASTA file (required for CRAM files)
+    """
+    import pysam
+
+    lengths = dict(contigs)
+    with pysam.AlignmentFile(bamfile, reference_filename=reference) as bam:
+        names = [name for name in bam.references if name in lengths]
+        names += [name for name, _ in contigs if name not in set(bam.references)]
+        order = {name: i for i, name in enumerate(names)}
+
+        current = 0
+        accumulator = _DepthAccumulator(lengths[names[0]]) if names else None
+        for read in bam.fetch(until_eof=True):
+            if read.is_unmapped or not read.cigartuples or read.reference_name not in order:
+                continue
+            index = order[read.reference_name]
+            if index < current:
+                raise ValueError("the BAM file must be sorted by coordinates")
+            # previous contigs are complete
+            while current < index:
+                for chunk in accumulator.flush():
+                    yield (names[current],) + chunk
+                current += 1
+                accumulator = _DepthAccumulator(lengths[names[current]])
+            if accumulator.is_full(read.reference_start):
+                for chunk in accumulator.flush(read.reference_start):
+                    yield (names[current],) + chunk
+            accumulator.add_read(read)
+
+        while current < len(names):
+            for chunk in accumulator.flush():
+                yield (names[current],) + chunk
+            current += 1
+            if current < len(names):
+                accumulator = _DepthAccumulator(lengths[names[current]])
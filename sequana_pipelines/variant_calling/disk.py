@@ -0,0 +1,132 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Peak disk usage of an analysis
+
+The disk usage of the directories of the samples (and of the shared
+directories such as the reference) is measured at regular intervals in a
+background thread while the pipeline runs::
+
+    monitor = DiskMonitor({"A": "A", "B": "B", "reference": "reference"}, interval=60)
+    monitor.start()
+    # ... jobs are running
+    monitor.stop()
+    monitor.summary()
+
+The peak of each directory and the peak of the total (sum of the directories
+at the same time) are reported. Intermediate files created and removed
+between two measurements are not seen.
+
+"""
+import os
+import threading
+import time
+
+
+def get_disk_usage(path):
+    """Return the space used by a file or directory (allocated blocks in bytes)
+
+    Symbolic links are not followed. Missing paths use no space.
+    """
+    try:
+        stat = os.stat(path, follow_symlinks=False)
+    except FileNotFoundError:
+        return 0
+    total = stat.st_blocks * 512
+    if not os.path.isdir(path) or os.path.islink(path):
+        return total
+
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except (FileNotFoundError, NotADirectoryError):
+            # removed during the walk
+            continue
+        for entry in entries:
+            try:
+                total += entry.stat(follow_symlinks=False).st_blocks * 512
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+            except FileNotFoundError:
+                continue
+    return total
+
+
+class DiskMonitor:
+    """Measure the peak disk usage of directories in a background thread
+
+    :param dict directories: path of each directory to measure (by name)
+    :param interval: time between two measurements in seconds
+    """
+
+    def __init__(self, directories, interval=60):
+        self.directories = directories
+        self.interval = interval
+        self.peaks = dict.fromkeys(directories, 0)
+        self.peak = 0
+        self.peak_time = None
+        self.final = None
+        self.measurements = 0
+        self._start = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def measure(self):
+        """Measure the disk usage of the directories and update the peaks
+
+        :return: the total disk usage
+        """
+        total = 0
+        for name, path in self.directories.items():
+            usage = get_disk_usage(path)
+            self.peaks[name] = max(self.peaks[name], usage)
+            total += usage
+        if total >= self.peak:
+            self.peak = total
+            self.peak_time = time.time()
+        self.measurements += 1
+        return total
+
+    def _run(self):
+        self.measure()
+        while not self._stop.wait(self.interval):
+            self.measure()
+
+    def start(self):
+        self._start = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the measurements (a last measurement is done)"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.final = self.measure()
+
+    def summary(self):
+        """Return the peaks in bytes (total and of each directory)
+
+        peak_time is the time of the total peak since the start of the
+        measurements (seconds).
+        """
+        start = self._start or self.peak_time
+        return {
+            "interval": self.interval,
+            "measurements": self.measurements,
+            "peak": self.peak,
+            "peak_time": round(self.peak_time - start) if self.peak_time else None,
+            "final": self.final,
+            "directories": dict(self.peaks),
+        }
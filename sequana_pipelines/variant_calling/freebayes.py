@@ -0,0 +1,297 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Guarded freebayes calling
+
+A single region with a very high coverage (collapsed repeats, contamination)
+can make freebayes use tens of GB and run for hours. In guarded mode:
+
+- the coverage evaluated by freebayes is capped (--limit-coverage) to a
+  multiple of the median coverage of the sample. The median coverage is
+  estimated from the index of the BAM/CRAM file called by freebayes (or from
+  its reads if it is not indexed, see :func:`get_coverage`).
+- each region is called with a time and memory budget. If the budget is
+  exceeded (see :func:`budget_exceeded`; other errors are raised), the region
+  is split into two sub-regions called in parallel, and so on. Sub-regions
+  that cannot be split anymore are called once more without budget, skipping
+  the positions with a coverage above the cap (--skip-coverage).
+
+The capped intervals are saved in a BED file (chrom, start, end, reason) so
+that the variants of these regions can be flagged in the report. The reason
+is limit_coverage (16kb windows with an estimated coverage above the cap),
+split or skip_coverage.
+
+"""
+import json
+import math
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def get_coverage(bamfile, contigs, index=None, reference=None, nreads=10000, factor=None, min_coverage=100):
+    """Estimate the mean and median coverage of a BAM or CRAM file
+
+    The mean coverage is the number of mapped reads (index statistics) times
+    the mean read length (first reads) divided by the reference length. The
+    median is the mean coverage scaled by the ratio of the median to the mean
+    data per 16kb window (see :func:`~sequana_pipelines.variant_calling.regions.get_bam_work`).
+    The coverage of a window is estimated in the same way.
+
+    Without index, the reads are counted in a single pass over the file
+    (read starts per 16kb window).
+
+    :param contigs: list of (name, length) (see :func:`~sequana_pipelines.variant_calling.regions.read_fai`)
+    :param index: the BAI/CRAI file. Defaults to the BAM/CRAM filename + .bai/.crai
+    :param reference: the reference (CRAM files)
+    :param factor: if set, the coverage cap (see :func:`get_coverage_cap`)
+        and the windows above the cap are returned as well
+    :param min_coverage: minimum value of the cap
+    :return: dictionary with the mean and median coverage (and the cap and
+        the list of [chrom, start, end] windows above the cap)
+    """
+    import pysam
+
+    from sequana_pipelines.variant_calling.regions import (
+        BAI_WINDOW,
+        get_bam_work,
+        get_cram_work,
+    )
+
+    total = sum(length for _, length in contigs)
+    index = index or bamfile + (".crai" if bamfile.endswith(".cram") else ".bai")
+    if not os.path.exists(index):
+        work = {name: np.zeros(math.ceil(length / BAI_WINDOW)) for name, length in contigs}
+        bases = 0
+        with pysam.AlignmentFile(bamfile, reference_filename=reference) as bam:
+            for read in bam.fetch(until_eof=True):
+                counts = None if read.is_unmapped else work.get(read.reference_name)
+                if counts is None or not len(counts):
+                    continue
+                bases += read.query_length or read.reference_length or 0
+                counts[min(read.reference_start // BAI_WINDOW, len(counts) - 1)] += 1
+        mean = bases / total if total else 0
+        return _get_coverage(mean, work, contigs, factor, min_coverage)
+
+    mapped = 0
+    for line in pysam.idxstats(bamfile).splitlines():
+        fields = line.split("\t")
+        if len(fields) >= 3:
+            mapped += int(fields[2])
+
+    lengths = []
+    with pysam.AlignmentFile(bamfile, reference_filename=reference) as bam:
+        for read in bam.fetch(until_eof=True):
+            if not read.is_unmapped:
+                lengths.append(read.query_length or read.reference_length or 0)
+            if len(lengths) >= nreads:
+                break
+
+    mean = mapped * np.mean(lengths) / total if lengths and total else 0
+
+    get_work = get_cram_work if bamfile.endswith(".cram") else get_bam_work
+    return _get_coverage(mean, get_work(bamfile, contigs, index=index), contigs, factor, min_coverage)
+
+
+def _get_cap(median, factor, min_coverage):
+    return max(min_coverage, math.ceil(factor * median))
+
+
+def _get_coverage(mean, work, contigs, factor, min_coverage):
+    from sequana_pipelines.variant_calling.regions import BAI_WINDOW
+
+    values = np.concatenate(list(work.values())) if work else np.zeros(0)
+    scale = mean / np.mean(values) if values.size and np.mean(values) > 0 else 0
+    median = float(np.median(values) * scale) if scale else float(mean)
+    coverage = {"mean": float(mean), "median": median}
+    if factor is None:
+        return coverage
+
+    # consecutive windows above the cap are merged
+    cap = _get_cap(median, factor, min_coverage)
+    windows = []
+    for name, length in contigs:
+        above = np.flatnonzero(work[name] * scale > cap)
+        for i in above:
+            start, end = int(i) * BAI_WINDOW, min(length, (int(i) + 1) * BAI_WINDOW)
+            if windows and windows[-1][0] == name and windows[-1][2] == start:
+                windows[-1][2] = end
+            else:
+                windows.append([name, start, end])
+    coverage.update(cap=cap, limit_coverage=windows)
+    return coverage
+
+
+def budget_exceeded(returncode, stderr=""):
+    """Return True if freebayes was stopped by its time or memory budget
+
+    timeout(1) exits with 124, a killed process (SIGKILL, e.g. out of memory)
+    with 137 (-9 from Python) and an allocation above the virtual memory limit
+    (ulimit -v) aborts with a std::bad_alloc message.
+
+    :param returncode: the exit status of the command
+    :param stderr: the error messages of the command
+    """
+    return returncode in (124, 137, -9) or "std::bad_alloc" in stderr
+
+
+def get_coverage_cap(filename, factor, min_coverage=100):
+    """Return the coverage cap of a sample (JSON file saved by the pipeline)
+
+    :param factor: the cap is this factor times the median coverage
+    :param min_coverage: minimum value of the cap
+    """
+    with open(filename) as fin:
+        coverage = json.load(fin)
+    return _get_cap(coverage["median"], factor, min_coverage)
+
+
+def get_limited_intervals(filename, intervals):
+    """Return the parts of the intervals with a coverage above the cap
+
+    :param filename: coverage of the sample (JSON file saved by the pipeline,
+        see :func:`get_coverage` with a factor)
+    :param intervals: list of (chrom, start, end), e.g. a freebayes region
+    :return: list of (chrom, start, end, "limit_coverage")
+    """
+    with open(filename) as fin:
+        windows = json.load(fin).get("limit_coverage", [])
+    limited = []
+    for chrom, start, end in intervals:
+        for name, wstart, wend in windows:
+            if name == chrom and wstart < end and start < wend:
+                limited.append((chrom, max(start, wstart), min(end, wend), "limit_coverage"))
+    return limited
+
+
+def read_bed(filename):
+    """Return the list of (chrom, start, end) intervals of a BED file"""
+    intervals = []
+    with open(filename) as fin:
+        for line in fin:
+            fields = line.split("\t")
+            if len(fields) >= 3:
+                intervals.append((fields[0], int(fields[1]), int(fields[2])))
+    return intervals
+
+
+def split_intervals(intervals):
+    """Split a list of intervals into two lists of (roughly) the same length"""
+    total = sum(end - start for _, start, end in intervals)
+    half = total // 2
+    first, second = [], []
+    done = 0
+    for chrom, start, end in intervals:
+        if done >= half:
+            second.append((chrom, start, end))
+        elif done + end - start <= half:
+            first.append((chrom, start, end))
+        else:
+            middle = start + half - done
+            first.append((chrom, start, middle))
+            second.append((chrom, middle, end))
+        done += end - start
+    return [x for x in (first, second) if x]
+
+
+def concat_vcfs(filenames, output):
+    """Concatenate VCF files (header of the first one). Compressed with BGZF if output ends with .gz"""
+    import pysam
+
+    plain = output[:-3] if output.endswith(".gz") else output
+    with open(plain, "w") as fout:
+        for i, filename in enumerate(filenames):
+            with open(filename) as fin:
+                for line in fin:
+                    if i == 0 or not line.startswith("#"):
+                        fout.write(line)
+    if plain != output:
+        pysam.tabix_compress(plain, output, force=True)
+        os.remove(plain)
+
+
+def call_guarded(run, bedfile, output, threads=1, min_length=10000, max_splits=4):
+    """Call the variants of a region with a budget (see module documentation)
+
+    :param run: function called as run(bed, vcf, last_resort) that calls the
+        variants of the BED file into the (plain) VCF file and returns False
+        if the budget was exceeded. With last_resort set, the call has no
+        budget and positions with a coverage above the cap are skipped.
+    :param bedfile: the region (BED file)
+    :param output: the VCF file (compressed if it ends with .gz)
+    :param threads: number of sub-regions called in parallel
+    :param min_length: regions shorter than this length are not split
+    :param max_splits: maximum number of successive splits
+    :return: list of (chrom, start, end, reason) of the split and skipped
+        intervals
+    """
+    workdir = f"{output}.guarded"
+    os.makedirs(workdir, exist_ok=True)
+
+    capped = []
+    parts = {}
+    # items are (key, intervals, level, last_resort). Keys keep the order of
+    # the sub-regions.
+    pending = [((0,), read_bed(bedfile), 0, False)]
+
+    def call(item):
+        key, intervals, _, last_resort = item
+        name = "_".join(str(x) for x in key)
+        bed, vcf = f"{workdir}/{name}.bed", f"{workdir}/{name}.vcf"
+        with open(bed, "w") as fout:
+            for chrom, start, end in intervals:
+                fout.write(f"{chrom}\t{start}\t{end}\n")
+        return vcf, run(bed, vcf, last_resort)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while pending:
+            results = list(executor.map(call, pending))
+            new = []
+            for (key, intervals, level, last_resort), (vcf, success) in zip(pending, results):
+                length = sum(end - start for _, start, end in intervals)
+                if success:
+                    parts[key] = vcf
+                    if last_resort:
+                        capped.extend((chrom, start, end, "skip_coverage") for chrom, start, end in intervals)
+                elif last_resort:
+                    raise RuntimeError(f"freebayes failed on {intervals}")
+                elif level < max_splits and length > min_length:
+                    capped.extend((chrom, start, end, "split") for chrom, start, end in intervals)
+                    for i, sub in enumerate(split_intervals(intervals)):
+                        new.append((key + (i,), sub, level + 1, False))
+                else:
+                    new.append((key, intervals, level, True))
+            pending = new
+
+    concat_vcfs([parts[key] for key in sorted(parts)], output)
+    shutil.rmtree(workdir)
+    return capped
+
+
+def write_capped(capped, output):
+    """Save the capped intervals in a BED file (with a reason column)"""
+    with open(output, "w") as fout:
+        for chrom, start, end, reason in capped:
+            fout.write(f"{chrom}\t{start}\t{end}\t{reason}\n")
+
+
+def read_capped(filename):
+    """Read the capped intervals (BED file with a reason column)"""
+    capped = []
+    with open(filename) as fin:
+        for line in fin:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 4:
+                capped.append((fields[0], int(fields[1]), int(fields[2]), fields[3]))
+    return capped
@@ -0,0 +1,199 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Merging of per-sample gVCF files created by freebayes (--gvcf option)
+
+Each sample is called independently on a region and the gVCF keeps the
+evidence on the reference allele between variants (reference blocks with an
+ALT set to <*>). The merge creates a multi-sample VCF with the union of the
+variants. Samples without the variant are genotyped as reference using the
+depth of the reference block that covers the position. Therefore, adding a
+sample to a cohort only requires to call that new sample.
+
+Alleles are normalised before the merge: bases shared by the REF and ALT
+alleles are trimmed (e.g. CAT>CGT at position 10 becomes A>G at position 11)
+and records of the samples at the same position are merged on the longest
+REF (e.g. C>T and CA>C become CA>TA,C).
+
+"""
+import bisect
+
+# INFO fields that are summed over samples. Others are dropped.
+SUMMED_INFO = ["RO", "SRF", "SRR"]
+SUMMED_INFO_PER_ALLELE = ["AO", "SAF", "SAR"]
+
+REF_BLOCK = "<*>"
+
+
+class _SampleGVCF:
+    """Variants and reference blocks of a single-sample gVCF"""
+
+    def __init__(self, filename):
+        import pysam
+
+        self.variants = {}
+        self.blocks = {}
+        with pysam.VariantFile(filename) as vcf:
+            self.header = vcf.header
+            self.sample = list(vcf.header.samples)[0]
+            for rec in vcf:
+                alts = list(rec.alts or [])
+                if any(x != REF_BLOCK for x in alts):
+                    pos, ref, alts = _normalise(rec.pos, rec.ref, alts)
+                    self.variants[(rec.chrom, pos)] = (rec, ref, alts)
+                else:
+                    data = rec.samples[self.sample]
+                    depth = _get(data, "MIN_DP", _get(data, "DP", rec.info.get("MIN_DP", 0)))
+                    self.blocks.setdefault(rec.chrom, []).append((rec.pos, rec.stop, depth or 0))
+
+        for blocks in self.blocks.values():
+            blocks.sort()
+        self.starts = {chrom: [x[0] for x in blocks] for chrom, blocks in self.blocks.items()}
+
+    def get_reference_depth(self, chrom, pos):
+        """Return depth of the reference block covering the position (or None)"""
+        if chrom not in self.blocks:
+            return None
+        i = bisect.bisect_right(self.starts[chrom], pos) - 1
+        if i >= 0:
+            start, stop, depth = self.blocks[chrom][i]
+            if start <= pos <= stop:
+                return depth
+        return None
+
+
+def _normalise(pos, ref, alts):
+    """Return position, REF and ALT alleles without the shared bases
+
+    Bases shared by all alleles are trimmed at the end, then at the start
+    (the position is shifted). One base is kept. Symbolic alleles (<*>) are
+    left unchanged.
+    """
+    alleles = [ref] + [x for x in alts if not x.startswith("<")]
+    while min(len(x) for x in alleles) > 1 and len({x[-1] for x in alleles}) == 1:
+        alleles = [x[:-1] for x in alleles]
+    while min(len(x) for x in alleles) > 1 and len({x[0] for x in alleles}) == 1:
+        alleles = [x[1:] for x in alleles]
+        pos += 1
+    trimmed = iter(alleles[1:])
+    return pos, alleles[0], [x if x.startswith("<") else next(trimmed) for x in alts]
+
+
+def _get(data, key, default=None):
+    # pysam raises KeyError on fields absent from the header
+    try:
+        value = data[key]
+    except KeyError:
+        return default
+    return default if value is None else value
+
+
+def merge_gvcfs(filenames, output, ploidy=1):
+    """Merge single-sample gVCF files into a multi-sample VCF
+
+    :param filenames: list of gVCF files (one sample each) created by freebayes
+        on the same region.
+    :param output: the output VCF filename
+    :param int ploidy: ploidy used for samples genotyped as reference.
+    """
+    import pysam
+
+    gvcfs = [_SampleGVCF(filename) for filename in filenames]
+
+    # header of the first file with all samples
+    header = pysam.VariantHeader()
+    for record in gvcfs[0].header.records:
+        if record.type in ("CONTIG", "INFO", "FORMAT", "GENERIC") and record.key != "fileformat":
+            header.add_record(record)
+    for gvcf in gvcfs:
+        header.add_sample(gvcf.sample)
+    contigs = list(header.contigs)
+
+    # REF of each site: the longest one (the others are prefixes)
+    refs = {}
+    for gvcf in gvcfs:
+        for key, (_, ref, _) in gvcf.variants.items():
+            if len(ref) > len(refs.get(key, "")):
+                refs[key] = ref
+
+    # union of all variants and their alleles (extended to the REF of the site)
+    sites = {}
+    for gvcf in gvcfs:
+        for key, (_, ref, alts) in gvcf.variants.items():
+            alleles = sites.setdefault(key, [])
+            suffix = refs[key][len(ref) :]
+            alleles.extend(x + suffix for x in alts if x != REF_BLOCK and x + suffix not in alleles)
+
+    # BGZF-compressed output if the name ends with .gz
+    mode = "wz" if output.endswith(".gz") else "w"
+    with pysam.VariantFile(output, mode, header=header) as fout:
+        for key in sorted(sites, key=lambda x: (contigs.index(x[0]), x[1])):
+            chrom, pos = key
+            alts = sites[key]
+            record = fout.new_record(contig=chrom, start=pos - 1, alleles=[refs[key]] + alts)
+
+            quals = []
+            info = {"DP": 0}
+            info.update({x: 0 for x in SUMMED_INFO})
+            info.update({x: [0] * len(alts) for x in SUMMED_INFO_PER_ALLELE})
+            types = {}
+
+            for gvcf in gvcfs:
+                sample = record.samples[gvcf.sample]
+                if key in gvcf.variants:
+                    rec, ref, sample_alts = gvcf.variants[key]
+                    data = rec.samples[gvcf.sample]
+                    # index of the sample alleles in the merged alleles (None for <*>)
+                    suffix = refs[key][len(ref) :]
+                    mapping = [0] + [None if x == REF_BLOCK else alts.index(x + suffix) + 1 for x in sample_alts]
+
+                    quals.append(rec.qual or 0)
+                    gt = _get(data, "GT", ())
+                    sample["GT"] = tuple(None if x is None else mapping[x] for x in gt)
+                    sample["DP"] = _get(data, "DP", 0)
+                    sample["RO"] = _get(data, "RO", 0)
+                    ao = [0] * len(alts)
+                    for i, value in enumerate(_get(data, "AO", ())):
+                        if mapping[i + 1] is not None:
+                            ao[mapping[i + 1] - 1] = value or 0
+                    sample["AO"] = ao
+
+                    info["DP"] += rec.info.get("DP", 0)
+                    for field in SUMMED_INFO:
+                        info[field] += rec.info.get(field, 0)
+                    for field in SUMMED_INFO_PER_ALLELE:
+                        for i, value in enumerate(rec.info.get(field, [])):
+                            if mapping[i + 1] is not None:
+                                info[field][mapping[i + 1] - 1] += value
+                    for i, value in enumerate(rec.info.get("TYPE", [])):
+                        if mapping[i + 1] is not None:
+                            types.setdefault(mapping[i + 1] - 1, value)
+                else:
+                    depth = gvcf.get_reference_depth(chrom, pos)
+                    if depth is None:
+                        # no read in that sample
+                        sample["GT"] = (None,) * ploidy
+                    else:
+                        sample["GT"] = (0,) * ploidy
+                        sample["DP"] = depth
+                        sample["RO"] = depth
+                        sample["AO"] = [0] * len(alts)
+                        info["DP"] += depth
+                        info["RO"] += depth
+
+            record.qual = max(quals)
+            for field, value in info.items():
+                if field in header.info:
+                    record.info[field] = value
+            if "TYPE" in header.info:
+                record.info["TYPE"] = [types.get(i, "snp") for i in range(len(alts))]
+            fout.write(record)
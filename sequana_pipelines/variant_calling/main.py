@@ -18,7 +18,8 @@ import rich_click as click
 
 click_completion.init()
 
-from sequana_pipetools import SequanaManager
+# Only the click options are needed at import time to build the command (and
+# --help). Everything else is imported when the command is called.
 from sequana_pipetools.options import *
 
 NAME = "variant_calling"
@@ -31,6 +32,7 @@ help = init_click(
             "--reference-file",
             "--aligner-choice",
             "--annotation-file",
+            "--cache-directory",
             "--circular",
             "--do-coverage",
             "--do-joint-calling",
@@ -91,9 +93,16 @@ help = init_click(
     show_default=True,
     help="""For population, or eukaryotes, change the ploidy to the correct values. For population, you may set it to 10.""",
 )
+@click.option(
+    "--cache-directory",
+    default="",
+    help="""Directory where reference indexes are saved and reused by other projects (e.g. a shared directory).""",
+)
 @click.option("-o", "--circular", is_flag=True, help="Recommended for bacteria genomes and circularised genomes")
 @click.option("--reference-file", "reference", required=True, help="The input reference to mapped reads onto")
 def main(**options):
+    from sequana_pipetools import SequanaManager
+
     # the real stuff is here
     manager = SequanaManager(options, NAME)
     manager.setup()
@@ -140,6 +149,10 @@ def main(**options):
         # required argument
         cfg.general.reference_file = os.path.abspath(options.reference)
 
+    def fill_cache_directory():
+        if options.cache_directory:
+            cfg.general.cache_directory = os.path.abspath(options.cache_directory)
+
     # first if option --long-read is used (overwritten by other options)
     if options.nanopore:
         cfg.general.aligner_choice = "minimap2"
@@ -163,12 +176,14 @@ def main(**options):
         fill_do_joint_freebayes()
         fill_ploidy_freebayes()
         fill_reference_file()
+        fill_cache_directory()
 
-    # Given the reference, let us compute its length and the index algorithm
-    from sequana import FastA
+    # Given the reference, let us compute its length and the index algorithm.
+    # The FASTA index is used if available, so that large references are not
+    # parsed.
+    from sequana_pipelines.variant_calling.regions import get_reference_length
 
-    f = FastA(cfg.general.reference_file)
-    N = f.get_stats()["total_length"]
+    N = get_reference_length(cfg.general.reference_file)
 
     # seems to be a hardcoded values in bwa according to the documentation
     if N >= 2000000000:
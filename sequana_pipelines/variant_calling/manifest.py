@@ -0,0 +1,61 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""List of the files read by MultiQC
+
+Instead of searching the whole working directory (BAM files, depth files,
+freebayes regions...), MultiQC is run on a manifest (--file-list) with the
+files of the enabled rules only. Each MultiQC module is given a list of
+patterns with a {sample} wildcard and shell wildcards for the names that are
+not known before the job is run (e.g. FastQC reports)::
+
+    patterns = {
+        "fastp": ["{sample}/fastp/fastp_{sample}.json"],
+        "fastqc": ["{sample}/fastqc/*_fastqc.zip"],
+    }
+    write_manifest(patterns, ["A", "B"], "multiqc/manifest.txt", modules=["fastp"])
+
+Only the directories of the patterns are listed.
+
+"""
+import glob
+
+
+def get_manifest(patterns, samples, modules=None):
+    """Return the files matching the patterns of the MultiQC modules
+
+    :param dict patterns: list of patterns of each MultiQC module
+    :param samples: names of the samples ({sample} wildcard)
+    :param modules: keep only the patterns of these modules (all if None)
+    :return: sorted list of existing files (no duplicates)
+    """
+    files = set()
+    for module, module_patterns in patterns.items():
+        if modules is not None and module not in modules:
+            continue
+        for pattern in module_patterns:
+            names = [pattern.format(sample=x) for x in samples] if "{sample}" in pattern else [pattern]
+            for name in names:
+                files.update(glob.glob(name))
+    return sorted(files)
+
+
+def write_manifest(patterns, samples, output, modules=None):
+    """Save the manifest (one file per line, see :func:`get_manifest`)
+
+    :return: the number of files
+    """
+    files = get_manifest(patterns, samples, modules=modules)
+    with open(output, "w") as fout:
+        for filename in files:
+            fout.write(f"{filename}\n")
+    return len(files)
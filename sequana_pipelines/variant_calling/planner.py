@@ -0,0 +1,394 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Threads, memory and runtime of the jobs from the size of their inputs
+
+The resources of the main rules are computed for each job from:
+
+- **sample**: the size (GB) of the input data of the sample (FastQ, BAM or
+  CRAM files). Intermediate files (e.g. BAM files) are assumed to be as large
+  as the input data so that the resources are known before they are created.
+  For freebayes, only the fraction of the data in the region is used (ratio
+  of the region length to the reference length).
+- **reference**: the length of the reference (Gb).
+
+Each model is linear. The memory (mem_mb) is ``base + sample * size_sample +
+reference * size_reference`` and the CPU time (minutes) is defined the same
+way. The runtime is the CPU time divided by the number of threads, which is
+one thread per ``gb_per_thread`` of data up to the threads set in the config
+file. The default coefficients are rough estimates for each tool.
+
+The models can be calibrated with the benchmarks of a previous analysis
+(benchmarks/ directory): the coefficients are scaled so that the models cover
+the largest ratio of observed to predicted values (with a margin of 20%).
+
+"""
+import copy
+import glob
+import json
+import math
+import os
+
+# default models. mem_mb in MB, cpu in minutes. Coefficients are per GB of
+# sample data or per Gb of reference.
+MODELS = {
+    "fastp": {"mem_mb": {"base": 1000, "sample": 100}, "cpu": {"base": 2, "sample": 15}, "gb_per_thread": 1},
+    "bwa_index": {"mem_mb": {"base": 500, "reference": 5500}, "cpu": {"base": 5, "reference": 90}},
+    "bwa": {
+        "mem_mb": {"base": 2500, "sample": 200, "reference": 2000},
+        "cpu": {"base": 5, "sample": 120},
+        "gb_per_thread": 0.5,
+    },
+    "bwa_intermediate": {
+        "mem_mb": {"base": 2500, "sample": 200, "reference": 2000},
+        "cpu": {"base": 5, "sample": 120},
+        "gb_per_thread": 0.5,
+    },
+    "minimap2_index": {"mem_mb": {"base": 1000, "reference": 4000}, "cpu": {"base": 2, "reference": 30}},
+    "minimap2": {
+        "mem_mb": {"base": 2000, "sample": 200, "reference": 4000},
+        "cpu": {"base": 5, "sample": 60},
+        "gb_per_thread": 0.5,
+    },
+    "add_read_group": {"mem_mb": {"base": 2000, "sample": 200}, "cpu": {"base": 2, "sample": 20}},
+    "sambamba_markdup": {
+        "mem_mb": {"base": 2000, "sample": 1000},
+        "cpu": {"base": 2, "sample": 15},
+        "gb_per_thread": 1,
+    },
+    "sambamba_filter": {"mem_mb": {"base": 500}, "cpu": {"base": 1, "sample": 5}, "gb_per_thread": 1},
+    "bam_processing": {"mem_mb": {"base": 2000, "sample": 1000}, "cpu": {"base": 2, "sample": 20}, "gb_per_thread": 1},
+    "bam_to_cram": {"mem_mb": {"base": 1000, "reference": 1000}, "cpu": {"base": 2, "sample": 20}, "gb_per_thread": 1},
+    "freebayes_intermediate": {"mem_mb": {"base": 500, "sample": 4000}, "cpu": {"base": 1, "sample": 600}},
+    "joint_freebayes_gvcf": {"mem_mb": {"base": 500, "sample": 4000}, "cpu": {"base": 1, "sample": 600}},
+    "joint_freebayes_intermediate": {"mem_mb": {"base": 500, "sample": 4000}, "cpu": {"base": 1, "sample": 600}},
+}
+
+# models are scaled to cover the observed values with this margin
+CALIBRATION_MARGIN = 1.2
+
+
+def get_region_length(filename):
+    """Return the total length of the intervals of a BED file"""
+    total = 0
+    with open(filename) as fin:
+        for line in fin:
+            fields = line.split("\t")
+            if len(fields) >= 3:
+                total += int(fields[2]) - int(fields[1])
+    return total
+
+
+def read_benchmark_record(filename):
+    """Return the values of a Snakemake benchmark file (first run) by column
+
+    Values are floats or None if not available (NA).
+    """
+    with open(filename) as fin:
+        header = fin.readline().rstrip("\n").split("\t")
+        values = fin.readline().rstrip("\n").split("\t")
+
+    def _float(x):
+        try:
+            return float(x)
+        except (TypeError, ValueError):
+            return None
+
+    return {key: _float(value) for key, value in zip(header, values)}
+
+
+def read_benchmark(filename):
+    """Return the running time (s), CPU time (minutes) and maximum RSS (MB) of a Snakemake benchmark file
+
+    Values are None if not available (NA).
+    """
+    record = read_benchmark_record(filename)
+    cpu = record.get("cpu_time")
+    return record.get("s"), (cpu / 60 if cpu is not None else None), record.get("max_rss")
+
+
+class ResourcePlanner:
+    """Threads and resources of the rules computed from the size of their inputs
+
+    ::
+
+        planner = ResourcePlanner(config, manager.samples, reference_file)
+
+        rule bwa:
+            threads: planner.get_threads("bwa", config["bwa"]["threads"])
+            resources: **planner.get_resources("bwa", config["bwa"]["resources"])
+
+    If the planner is not activated (resources_planner:do), the threads and
+    resources of the config file are returned as they are.
+
+    :param config: the pipeline configuration (resources_planner section).
+    :param samples: dictionary of the samples and their input files.
+    :param reference: the reference FASTA file.
+    :param index: FASTA index of the reference used by the pipeline. Used
+        instead of the reference if it exists.
+    :param regions_directory: directory of the freebayes regions (BED files).
+    """
+
+    def __init__(self, config, samples, reference, index=None, regions_directory="resources/regions"):
+        params = config.get("resources_planner", {}) or {}
+        self.do = params.get("do", False)
+        self.priorities = params.get("priorities", True)
+        self.max_mem_mb = params.get("max_mem_mb", 64000)
+        self.max_runtime = params.get("max_runtime", 4320)
+        self.samples = samples
+        self.reference = reference
+        self.index = index
+        self.regions_directory = regions_directory
+        self.models = copy.deepcopy(MODELS)
+        self._reference_length = None
+        self._sample_sizes = {}
+
+        if self.do and params.get("calibration_directory"):
+            self.calibrate(params["calibration_directory"])
+
+    @property
+    def reference_length(self):
+        """Length of the reference in Gb"""
+        if self._reference_length is None:
+            from sequana_pipelines.variant_calling.regions import (
+                get_reference_length,
+                read_fai,
+            )
+
+            if self.index and os.path.exists(self.index):
+                self._reference_length = sum(length for _, length in read_fai(self.index)) / 1e9
+            else:
+                self._reference_length = get_reference_length(self.reference) / 1e9
+        return self._reference_length
+
+    def get_sample_size(self, sample):
+        """Return the size of the input files of a sample in GB"""
+        if sample not in self._sample_sizes:
+            files = self.samples[sample]
+            files = [files] if isinstance(files, str) else files
+            self._sample_sizes[sample] = sum(os.path.getsize(x) for x in files if x) / 1e9
+        return self._sample_sizes[sample]
+
+    def get_sizes(self, wildcards, reference_length=None, sample_sizes=None, regions_directory=None):
+        """Return the sizes (sample in GB, reference in Gb) of a job
+
+        The sample data of a region (chrom and chunk wildcards) is the fraction
+        of the data of the sample in the region. Without sample wildcard, the
+        data of all samples is used (joint calling).
+        """
+        reference_length = self.reference_length if reference_length is None else reference_length
+        get_sample_size = self.get_sample_size if sample_sizes is None else sample_sizes.get
+        samples = self.samples if sample_sizes is None else sample_sizes
+        regions_directory = regions_directory or self.regions_directory
+
+        if "sample" in wildcards.keys():
+            sample = get_sample_size(wildcards["sample"]) or 0
+        else:
+            sample = sum(get_sample_size(x) or 0 for x in samples)
+
+        if "chrom" in wildcards.keys() and reference_length:
+            bed = f"{regions_directory}/data.{wildcards['chrom']}.region.{wildcards['chunk']}.bed"
+            sample *= min(1, get_region_length(bed) / (reference_length * 1e9))
+        return {"sample": sample, "reference": reference_length}
+
+    def predict(self, rule, sizes, key):
+        """Return the predicted value (mem_mb or cpu) of a rule for the given sizes"""
+        model = self.models[rule][key]
+        return model.get("base", 0) + sum(model.get(x, 0) * sizes[x] for x in ("sample", "reference"))
+
+    def _threads(self, rule, sizes, max_threads):
+        gb_per_thread = self.models[rule].get("gb_per_thread")
+        if not gb_per_thread:
+            return 1
+        return max(1, min(max_threads, math.ceil(sizes["sample"] / gb_per_thread)))
+
+    def get_threads(self, rule, threads):
+        """Return the threads of a rule (callable if the planner is activated)
+
+        :param threads: threads set in the config file, used as upper bound.
+        """
+        if not self.do:
+            return threads
+
+        def _get_threads(wildcards):
+            return self._threads(rule, self.get_sizes(wildcards), threads)
+
+        return _get_threads
+
+    def get_resources(self, rule, resources=None):
+        """Return the resources of a rule (mem_mb and runtime are callables if the planner is activated)
+
+        The memory is multiplied by the attempt number (see --retries).
+
+        :param resources: resources set in the config file. The memory and
+            runtime are replaced by the planned values.
+        """
+        resources = dict(resources or {})
+        if not self.do:
+            return resources
+
+        for key in ("mem", "mem_mb", "runtime"):
+            resources.pop(key, None)
+
+        def mem_mb(wildcards, attempt):
+            value = self.predict(rule, self.get_sizes(wildcards), "mem_mb") * attempt
+            return min(self.max_mem_mb, math.ceil(value))
+
+        def runtime(wildcards, threads):
+            value = self.predict(rule, self.get_sizes(wildcards), "cpu") / threads
+            return min(self.max_runtime, math.ceil(value))
+
+        resources["mem_mb"] = mem_mb
+        resources["runtime"] = runtime
+        return resources
+
+    def get_priority(self, rule, downstream=()):
+        """Return the priority of a rule (callable of the wildcards)
+
+        The priority is the CPU time (seconds) of the remaining work of the
+        sample: the job itself and the downstream rules, which process the
+        whole sample. The largest samples start first (longest processing time
+        first), which shortens the total time of the analysis. Only the terms
+        of the models that depend on the data of the sample are used.
+
+        :param downstream: the rules run after this one on the same sample.
+        """
+        if not self.priorities:
+            return 0
+
+        def _priority(wildcards):
+            if "chrom" in wildcards.keys():
+                size = self.get_sizes(wildcards)["sample"]
+            else:
+                size = self.get_sample_size(wildcards["sample"])
+            work = self.models[rule]["cpu"].get("sample", 0) * size
+            whole = self.get_sample_size(wildcards["sample"])
+            work += sum(self.models[x]["cpu"].get("sample", 0) * whole for x in downstream)
+            return round(work * 60)
+
+        return _priority
+
+    def write_sizes(self, filename):
+        """Save the sizes of the samples and reference (used for the calibration)"""
+        sizes = {
+            "reference": self.reference_length,
+            "samples": {sample: self.get_sample_size(sample) for sample in self.samples},
+        }
+        with open(filename, "w") as fout:
+            json.dump(sizes, fout, indent=4)
+
+    def calibrate(self, directory):
+        """Scale the models with the benchmarks of a previous analysis
+
+        The benchmarks are expected in {directory}/benchmarks/{rule}/ with the
+        sizes of the analysis in {directory}/benchmarks/sizes.json (see
+        :meth:`write_sizes`). File names are made of the wildcards:
+        {sample}.tsv, {sample}/data.{chrom}.region.{chunk}.tsv,
+        data.{chrom}.region.{chunk}.tsv (joint calling) or reference.tsv.
+
+        :return: the scaling factors (memory, CPU) of each rule
+        """
+        sizes_file = f"{directory}/benchmarks/sizes.json"
+        if not os.path.exists(sizes_file):
+            return {}
+        with open(sizes_file) as fin:
+            sizes = json.load(fin)
+
+        factors = {}
+        for rule in self.models:
+            ratios = {"mem_mb": [], "cpu": []}
+            for filename in glob.glob(f"{directory}/benchmarks/{rule}/**/*.tsv", recursive=True):
+                name = os.path.relpath(filename, f"{directory}/benchmarks/{rule}")[:-4]
+                wildcards = {}
+                if "/" in name:
+                    wildcards["sample"], name = name.split("/", 1)
+                elif not name.startswith("data.") and name != "reference":
+                    wildcards["sample"] = name
+                if name.startswith("data.") and ".region." in name:
+                    wildcards["chrom"], wildcards["chunk"] = name[5:].rsplit(".region.", 1)
+                if "sample" in wildcards and wildcards["sample"] not in sizes["samples"]:
+                    continue
+                try:
+                    job_sizes = self.get_sizes(
+                        wildcards,
+                        reference_length=sizes["reference"],
+                        sample_sizes=sizes["samples"],
+                        regions_directory=f"{directory}/resources/regions",
+                    )
+                except OSError:
+                    continue
+
+                _, cpu, mem = read_benchmark(filename)
+                for key, observed in (("mem_mb", mem), ("cpu", cpu)):
+                    predicted = self.predict(rule, job_sizes, key)
+                    if observed and predicted > 0:
+                        ratios[key].append(observed / predicted)
+
+            for key, values in ratios.items():
+                if values:
+                    factor = max(values) * CALIBRATION_MARGIN
+                    model = self.models[rule][key]
+                    for term in model:
+                        model[term] *= factor
+                    factors.setdefault(rule, {})[key] = factor
+        return factors
+
+
+def get_makespan_summary(directory, cores, start, end=None):
+    """Compare the time of an analysis to its theoretical lower bound
+
+    The lower bound is the largest of (1) the CPU time of all jobs divided by
+    the number of cores and (2) the longest chain of jobs of a sample (jobs of
+    the regions of a sample run in parallel: only the longest one is counted).
+    Only the benchmarked jobs that ran after ``start`` are used.
+
+    :param directory: the benchmarks directory ({rule}/{wildcards}.tsv files).
+    :param cores: number of cores of the analysis (None if unknown, e.g. on a
+        cluster: the work bound is then not computed).
+    :param start: start time of the analysis (seconds since the epoch).
+    :param end: end time (now by default).
+    :return: dictionary with the makespan, the bounds (seconds) and the
+        efficiency (lower bound / makespan).
+    """
+    import time
+
+    end = time.time() if end is None else end
+    work = 0
+    chains = {}
+    for filename in glob.glob(f"{directory}/*/**/*.tsv", recursive=True):
+        if os.path.getmtime(filename) < start:
+            continue
+        seconds, cpu, _ = read_benchmark(filename)
+        seconds = seconds or 0
+        work += cpu * 60 if cpu is not None else seconds
+
+        rule, name = os.path.relpath(filename, directory)[:-4].split(os.sep, 1)
+        if name in ("reference", "all") or name.startswith("data."):
+            # indexing, joint calling and summaries are not part of a sample chain
+            continue
+        sample = name.split(os.sep)[0]
+        steps = chains.setdefault(sample, {})
+        steps[rule] = max(steps.get(rule, 0), seconds)
+
+    makespan = end - start
+    work_bound = work / max(cores, 1) if cores else None
+    path_bound = max((sum(x.values()) for x in chains.values()), default=0)
+    lower_bound = max(work_bound or 0, path_bound)
+    return {
+        "makespan": round(makespan, 1),
+        "cores": cores,
+        "cpu_time": round(work, 1),
+        "work_bound": round(work_bound, 1) if work_bound is not None else None,
+        "path_bound": round(path_bound, 1),
+        "lower_bound": round(lower_bound, 1),
+        "efficiency": round(lower_bound / makespan, 3) if makespan > 0 else None,
+    }
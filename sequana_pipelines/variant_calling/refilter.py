@@ -0,0 +1,111 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Apply new filter thresholds on an analysed project
+
+The tables of variants saved by the pipeline ({sample}.table.pkl) are
+filtered with the thresholds of the project's config.yaml
+(freebayes_vcf_filter and joint_freebayes_vcf_filter sections). The filtered
+VCF, CSV, BCF, HTML reports and statistics (outputs/stats.csv) are created
+again without parsing the VCF files.
+
+"""
+import glob
+import os
+
+import rich_click as click
+
+
+def write_bcf(vcf, bcf):
+    """Save a VCF file in BCF format"""
+    import pysam
+
+    with pysam.VariantFile(vcf) as fin, pysam.VariantFile(bcf, "wb", header=fin.header) as fout:
+        for record in fin:
+            fout.write(record)
+
+
+def refilter(table, filter_dict, prefix, report_dir, vcf_ext=".vcf"):
+    """Filter a table of variants. Return the number of variants kept
+
+    :param prefix: prefix of the output files ({prefix}.filter.vcf, .csv, .bcf)
+    """
+    from sequana_pipelines.variant_calling.vcf import VariantTable
+
+    output_vcf = f"{prefix}.filter{vcf_ext}"
+    count = VariantTable.load(table).filter(
+        filter_dict, output_vcf, output_csv=f"{prefix}.filter.csv", report_dir=report_dir
+    )
+    if os.path.exists(f"{prefix}.filter.bcf"):
+        write_bcf(output_vcf, f"{prefix}.filter.bcf")
+    return count
+
+
+@click.command()
+@click.option(
+    "--working-directory",
+    default=".",
+    show_default=True,
+    help="The working directory of the analysis (with its config.yaml)",
+)
+def main(working_directory):
+    """Filter the variants of all samples again with the config.yaml thresholds
+
+    Edit the freebayes_vcf_filter (and joint_freebayes_vcf_filter) section of
+    the config.yaml file and call this command in the working directory. With
+    freebayes_vcf_filter:per_region, variants were already filtered with the
+    previous thresholds, which can only be made more stringent.
+    """
+    import pandas as pd
+    import yaml
+
+    from sequana_pipelines.variant_calling.vcf import (
+        merge_variant_stats,
+        write_variant_stats,
+    )
+
+    os.chdir(working_directory)
+    with open("config.yaml") as fin:
+        config = yaml.safe_load(fin)
+    vcf_ext = ".vcf.gz" if config["general"].get("compressed_vcf", False) else ".vcf"
+
+    counts = {}
+    for table in sorted(glob.glob("*/freebayes_vcf_filter/*.table.pkl")):
+        sample = table.split(os.sep)[0]
+        prefix = f"{sample}/freebayes_vcf_filter/{sample}"
+        counts[sample] = refilter(table, config["freebayes_vcf_filter"], prefix, sample, vcf_ext=vcf_ext)
+        click.echo(f"{sample}: {counts[sample]} variants")
+
+    if os.path.exists("joint_calling/joint_calling.table.pkl"):
+        count = refilter(
+            "joint_calling/joint_calling.table.pkl",
+            config["joint_freebayes_vcf_filter"],
+            "joint_calling/joint_calling",
+            "joint_calling",
+            vcf_ext=vcf_ext,
+        )
+        click.echo(f"joint calling: {count} variants")
+
+    # statistics of the samples and summary
+    stats = []
+    for sample in counts:
+        filename = f"{sample}/freebayes_vcf_filter/{sample}.stats.csv"
+        if os.path.exists(filename):
+            raw_count = pd.read_csv(filename)["raw"][0]
+            write_variant_stats(filename, sample, raw_count, f"{sample}/freebayes_vcf_filter/{sample}.filter{vcf_ext}")
+            stats.append(filename)
+    if stats and os.path.exists("outputs/stats.csv"):
+        merge_variant_stats(stats, "outputs/stats.csv")
+
+
+if __name__ == "__main__":
+    main()
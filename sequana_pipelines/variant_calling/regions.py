@@ -0,0 +1,339 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Decomposition of the reference into regions for freebayes
+
+The regions are written as BED files named ``data.{chrom}.region.{chunk}.bed``
+in a single directory. Each file is consumed by one freebayes job.
+
+Two modes are available:
+
+- **fixed**: windows of fixed size (same as fasta_generate_regions.py from
+  freebayes).
+- **depth**: windows with roughly equal expected work. The work is estimated
+  from the linear index of the BAM files (BAI), which stores the file offset
+  of the first read of every 16kb window. The difference between two
+  consecutive offsets is the amount of compressed data (reads) in that window,
+  which is a good proxy of the freebayes running time. No read is decoded.
+  For CRAM files, the size of each slice listed in the CRAI index is spread
+  over the windows covered by the slice.
+
+With draft assemblies made of many contigs, consecutive small regions can be
+packed into a single BED file (see :func:`pack_regions`).
+
+"""
+import gzip
+import math
+import os
+import struct
+
+import numpy as np
+
+# size of a window in the BAI linear index (2**14)
+BAI_WINDOW = 16384
+
+# pseudo bin used by samtools/htslib to store metadata in the BAI
+BAI_PSEUDO_BIN = 37450
+
+
+def read_fai(filename):
+    """Return list of (name, length) tuples stored in a FASTA index file"""
+    contigs = []
+    with open(filename, "r") as fin:
+        for line in fin:
+            if line.strip():
+                fields = line.split("\t")
+                contigs.append((fields[0], int(fields[1])))
+    return contigs
+
+
+def get_reference_length(filename, chunksize=2**22):
+    """Return the total length of the sequences of a FASTA file
+
+    The lengths are read from the FASTA index ({filename}.fai) if it exists
+    and is more recent than the FASTA file. Otherwise, the file is read by
+    chunks of bytes and the bytes of the sequences are counted (headers and
+    end of lines excluded); no record is built so this is fast even for
+    multi-GB references. Gzipped files are supported.
+    """
+    fai = f"{filename}.fai"
+    if os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(filename):
+        return sum(length for _, length in read_fai(fai))
+
+    opener = gzip.open if filename.endswith(".gz") else open
+    total = 0
+    in_header = False
+    line_start = True
+    with opener(filename, "rb") as fin:
+        for chunk in iter(lambda: fin.read(chunksize), b""):
+            pos, N = 0, len(chunk)
+            while pos < N:
+                if in_header:
+                    end = chunk.find(b"\n", pos)
+                    if end == -1:
+                        break
+                    in_header, line_start, pos = False, True, end + 1
+                elif line_start and chunk[pos] == 62:  # '>'
+                    in_header = True
+                else:
+                    # sequence up to the next header (or end of chunk)
+                    end = chunk.find(b"\n>", pos)
+                    end = N if end == -1 else end + 1
+                    total += end - pos - chunk.count(b"\n", pos, end) - chunk.count(b"\r", pos, end)
+                    line_start, pos = chunk[end - 1] == 10, end
+    return total
+
+
+def read_bai_linear_index(filename):
+    """Read the linear index of a BAI file
+
+    :return: a list with one item per reference. Each item is a tuple made of
+        the linear index (numpy array of compressed file offsets, one per 16kb
+        window) and the compressed offset of the end of the reference's reads
+        (or None if the reference has no reads).
+    """
+    with open(filename, "rb") as fin:
+        data = fin.read()
+
+    if data[:4] != b"BAI\1":
+        raise ValueError(f"{filename} is not a valid BAI index")
+
+    pos = 4
+    (n_ref,) = struct.unpack_from("<i", data, pos)
+    pos += 4
+
+    references = []
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        ref_end = None
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, pos)
+            pos += 8
+            if bin_id == BAI_PSEUDO_BIN and n_chunk == 2:
+                # first chunk is (ref_beg, ref_end) virtual offsets
+                _, end = struct.unpack_from("<QQ", data, pos)
+                ref_end = end >> 16
+            pos += 16 * n_chunk
+        (n_intv,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        offsets = np.frombuffer(data, dtype="<u8", count=n_intv, offset=pos)
+        pos += 8 * n_intv
+        references.append((offsets >> 16, ref_end))
+    return references
+
+
+def get_bam_work(bamfile, contigs, index=None):
+    """Estimate the work of each 16kb window of a BAM file
+
+    :param bamfile: a sorted and indexed BAM file
+    :param contigs: list of (name, length) (see :func:`read_fai`)
+    :param index: the BAI file. Defaults to the BAM filename + .bai
+    :return: dictionary with contig names as keys and arrays of compressed
+        bytes per window as values.
+    """
+    import pysam
+
+    index = index or bamfile + ".bai"
+    with pysam.AlignmentFile(bamfile) as bam:
+        names = list(bam.references)
+    linear = read_bai_linear_index(index)
+
+    work = {}
+    for name, length in contigs:
+        nwin = math.ceil(length / BAI_WINDOW)
+        counts = np.zeros(nwin)
+        if name in names:
+            offsets, ref_end = linear[names.index(name)]
+            if ref_end is not None and len(offsets):
+                # empty windows may be stored as 0; offsets must be increasing
+                offsets = np.maximum.accumulate(offsets[:nwin])
+                bounds = np.append(offsets, max(ref_end, offsets[-1]))
+                counts[: len(offsets)] = np.diff(bounds)
+        work[name] = counts
+    return work
+
+
+def read_crai(filename):
+    """Read a CRAI index (gzipped text file, one line per slice)
+
+    :return: list of (reference index, start, span, slice size) tuples. Start
+        is 1-based. Unmapped slices (reference -1) are ignored.
+    """
+    slices = []
+    with gzip.open(filename, "rt") as fin:
+        for line in fin:
+            fields = line.split()
+            if len(fields) == 6 and int(fields[0]) >= 0:
+                ref, start, span, _, _, size = map(int, fields)
+                slices.append((ref, start, span, size))
+    return slices
+
+
+def get_cram_work(cramfile, contigs, index=None):
+    """Same as :func:`get_bam_work` for a CRAM file
+
+    :param index: the CRAI file. Defaults to the CRAM filename + .crai
+    """
+    import pysam
+
+    index = index or cramfile + ".crai"
+    # the header is read without decoding the reads (no reference needed)
+    with pysam.AlignmentFile(cramfile, check_sq=False) as cram:
+        names = list(cram.references)
+
+    work = {name: np.zeros(math.ceil(length / BAI_WINDOW)) for name, length in contigs}
+    for ref, start, span, size in read_crai(index):
+        counts = work.get(names[ref]) if ref < len(names) else None
+        if counts is None or not len(counts):
+            continue
+        first = min((start - 1) // BAI_WINDOW, len(counts) - 1)
+        last = min((start - 1 + max(span, 1) - 1) // BAI_WINDOW, len(counts) - 1)
+        counts[first : last + 1] += size / (last - first + 1)
+    return work
+
+
+def get_fixed_regions(contigs, chunksize):
+    """Decompose contigs into windows of fixed size
+
+    :return: list of (chrom, start, end) in BED coordinates
+    """
+    regions = []
+    for name, length in contigs:
+        for start in range(0, length, chunksize):
+            regions.append((name, start, min(start + chunksize, length)))
+    return regions
+
+
+def get_balanced_regions(contigs, work, nregions, min_size=1000, baseline=0.1):
+    """Decompose contigs into regions with roughly equal amount of work
+
+    The work of each window is assumed to be uniformly distributed so that
+    boundaries can be set anywhere (not only on window boundaries).
+
+    :param contigs: list of (name, length)
+    :param work: dictionary with per-window work for each contig (see
+        :func:`get_bam_work`). Several samples can be pooled by summing their
+        arrays.
+    :param nregions: expected number of regions over the entire reference.
+    :param min_size: regions are not shorter than this value (except
+        for contigs shorter than min_size)
+    :param baseline: fraction of the mean work per base added to every
+        position so that regions without reads are not arbitrarily long.
+    :return: list of (chrom, start, end) in BED coordinates
+    """
+    total_length = sum(length for _, length in contigs)
+    total_work = sum(work[name].sum() for name, _ in contigs)
+    base = baseline * total_work / total_length if total_work else 1.0
+    target = (total_work + base * total_length) / max(1, nregions)
+
+    regions = []
+    for name, length in contigs:
+        # cumulated work along the contig at each window boundary
+        edges = np.minimum(np.arange(len(work[name]) + 1) * BAI_WINDOW, length)
+        cumwork = np.concatenate([[0], np.cumsum(work[name])]) + base * edges
+
+        nchunks = int(round(cumwork[-1] / target))
+        nchunks = max(1, min(nchunks, length // min_size))
+
+        # positions where the cumulated work reaches i/nchunks of the total
+        levels = cumwork[-1] * np.arange(1, nchunks) / nchunks
+        cuts = np.round(np.interp(levels, cumwork, edges)).astype(int)
+        bounds = np.unique(np.concatenate([[0], cuts, [length]]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            regions.append((name, int(start), int(end)))
+    return regions
+
+
+def get_regions_work(regions, work, baseline=0.1):
+    """Return the work of each region (see :func:`get_balanced_regions`)
+
+    The work is assumed to be uniformly distributed within a window.
+    """
+    cumulative = {}
+    weights = []
+    for chrom, start, end in regions:
+        if chrom not in cumulative:
+            counts = work[chrom]
+            edges = np.arange(len(counts) + 1) * BAI_WINDOW
+            cumulative[chrom] = (edges, np.concatenate([[0], np.cumsum(counts)]))
+        edges, cumwork = cumulative[chrom]
+        weights.append(float(np.interp(end, edges, cumwork) - np.interp(start, edges, cumwork)))
+
+    lengths = [end - start for _, start, end in regions]
+    base = baseline * sum(weights) / sum(lengths) if sum(weights) else 1.0
+    return [weight + base * length for weight, length in zip(weights, lengths)]
+
+
+def pack_regions(regions, size, weights=None):
+    """Pack consecutive regions into shards of at most *size*
+
+    Regions are kept in the same order so that the calls of all shards can be
+    concatenated without sorting. Regions larger than *size* are alone in their
+    shard. This is useful for references made of many small contigs.
+
+    :param regions: list of (chrom, start, end)
+    :param size: maximum size (or work) of a shard. If 0, no packing is done.
+    :param weights: the weight of each region. Defaults to the regions' lengths.
+    :return: list of shards, each shard being a list of regions.
+    """
+    if not size:
+        return [[region] for region in regions]
+
+    if weights is None:
+        weights = [end - start for _, start, end in regions]
+
+    shards = []
+    current, total = [], 0
+    for region, weight in zip(regions, weights):
+        if current and total + weight > size:
+            shards.append(current)
+            current, total = [], 0
+        current.append(region)
+        total += weight
+    if current:
+        shards.append(current)
+    return shards
+
+
+def write_regions(shards, directory, prefix="data"):
+    """Save each shard in a BED file ``{prefix}.{chrom}.region.{chunk}.bed``
+
+    The chrom is the first contig of a shard. Chunks are numbered from 1 for
+    each chrom. The list of shards is also saved in *directory/regions.txt*
+    (in the reference order) so that the shards can be retrieved without
+    scanning the directory.
+
+    :param shards: list of shards (see :func:`pack_regions`)
+    :return: the shard names
+    """
+    os.makedirs(directory, exist_ok=True)
+    chunks = {}
+    names = []
+    for shard in shards:
+        chrom = shard[0][0]
+        chunks[chrom] = chunks.get(chrom, 0) + 1
+        name = f"{prefix}.{chrom}.region.{chunks[chrom]}"
+        with open(f"{directory}/{name}.bed", "w") as fout:
+            for contig, start, end in shard:
+                fout.write(f"{contig}\t{start}\t{end}\n")
+        names.append(name)
+
+    with open(f"{directory}/regions.txt", "w") as fout:
+        fout.write("\n".join(names) + "\n")
+    return names
+
+
+def read_regions(directory):
+    """Return the shard names saved by :func:`write_regions`"""
+    with open(f"{directory}/regions.txt", "r") as fin:
+        return fin.read().split()
@@ -0,0 +1,102 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Reproducible random subsample of the reads for quality control
+
+FastQC plots are stable after a few million reads. With fastqc:subsample set,
+FastQC is run on a random subsample of each file: a number of reads (value
+above 1) or a fraction of the reads (value below 1)::
+
+    subsample_file("A_R1_.fastq.gz", "A_R1_.subsampled.fastq.gz", 1000000, seed=1)
+
+The reads are streamed (the input file is not decompressed on disk). A number
+of reads is selected with a reservoir (only the selected reads are kept in
+memory), a fraction with a single pass. The selection only depends on the
+seed and on the number of reads so that the same pairs are selected in the R1
+and R2 files.
+
+"""
+import gzip
+import os
+import random
+
+
+def sample_records(records, subsample, seed=0):
+    """Yield a random subsample of the records (in their original order)
+
+    :param records: iterable of records
+    :param subsample: number of records (value above 1) or fraction of
+        records (value below 1)
+    :param seed: seed of the random generator
+    """
+    rng = random.Random(seed)
+    if subsample < 1:
+        for record in records:
+            if rng.random() < subsample:
+                yield record
+        return
+
+    # reservoir sampling (algorithm R)
+    nreads = int(subsample)
+    reservoir = []
+    for i, record in enumerate(records):
+        if i < nreads:
+            reservoir.append((i, record))
+        else:
+            j = rng.randint(0, i)
+            if j < nreads:
+                reservoir[j] = (i, record)
+    for _, record in sorted(reservoir, key=lambda x: x[0]):
+        yield record
+
+
+def get_subsample_name(filename, directory):
+    """Return the name of the subsample of a FASTQ or BAM file
+
+    e.g. A_R1_.fastq.gz gives {directory}/A_R1_.subsampled.fastq.gz (the
+    sample names of the MultiQC report end with '.subsampled').
+    """
+    name = os.path.basename(filename)
+    for ext in (".fastq.gz", ".fq.gz", ".fastq", ".fq", ".bam"):
+        if name.endswith(ext):
+            name = name[: -len(ext)]
+            break
+    ext = ".bam" if filename.endswith(".bam") else ".fastq.gz"
+    return f"{directory}/{name}.subsampled{ext}"
+
+
+def subsample_file(filename, output, subsample, seed=0):
+    """Save a random subsample of a FASTQ (plain or gzipped) or BAM file
+
+    The FASTQ subsample is compressed (fast compression level), the BAM
+    subsample keeps the header of the input file.
+
+    :return: the number of reads saved
+    """
+    count = 0
+    if filename.endswith(".bam"):
+        import pysam
+
+        with pysam.AlignmentFile(filename, check_sq=False) as bam:
+            with pysam.AlignmentFile(output, "wb", template=bam) as fout:
+                for read in sample_records(bam.fetch(until_eof=True), subsample, seed=seed):
+                    fout.write(read)
+                    count += 1
+        return count
+
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rb") as fin, gzip.open(output, "wb", compresslevel=1) as fout:
+        # records of 4 lines
+        for record in sample_records(zip(fin, fin, fin, fin), subsample, seed=seed):
+            fout.write(b"".join(record))
+            count += 1
+    return count
@@ -0,0 +1,323 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2021 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Utilities for VCF files that can be plain text or BGZF-compressed
+
+When general:compressed_vcf is set, the VCF files are compressed with bgzip
+(extension .vcf.gz) and indexed with tabix (.tbi).
+
+The freebayes filter (same as sequana html-report) is applied on a columnar
+table of the variants (see :class:`VariantTable`): the VCF is parsed once and
+the table is saved so that new thresholds are applied with a vectorized mask
+(see the sequana_variant_calling_refilter command)::
+
+    table = VariantTable.from_vcf("sample.ann.vcf")
+    table.save("sample.table.pkl")
+    VariantTable.load("sample.table.pkl").filter({"min_depth": 20}, "sample.filter.vcf")
+
+"""
+import gzip
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+# parameters of the sequana VCF filter and their default values (same as
+# sequana html-report)
+FILTER_DEFAULTS = {
+    "freebayes_score": 20,
+    "frequency": 0.1,
+    "min_depth": 10,
+    "forward_depth": 3,
+    "reverse_depth": 3,
+    "strand_ratio": 0.2,
+    "keep_polymorphic": True,
+}
+
+
+# types of variants reported in the statistics
+VARIANT_TYPES = ["snp", "mnp", "indel", "complex"]
+
+
+def get_plain_name(filename):
+    """Return the name of the uncompressed file (without .gz)"""
+    return filename[:-3] if filename.endswith(".gz") else filename
+
+
+def compress_vcf(filename, output):
+    """Compress a plain VCF into *output* (BGZF) and index it (tabix)
+
+    The plain file is removed. Nothing is done if *output* is not a .gz file.
+    """
+    import pysam
+
+    if not output.endswith(".gz"):
+        if filename != output:
+            os.rename(filename, output)
+        return
+    pysam.tabix_compress(filename, output, force=True)
+    pysam.tabix_index(output, preset="vcf", force=True)
+    os.remove(filename)
+
+
+def _open_vcf(filename):
+    opener = gzip.open if filename.endswith(".gz") else open
+    return opener(filename, "rt")
+
+
+def count_variants(filename):
+    """Return the number of records of a VCF (plain or compressed)"""
+    with _open_vcf(filename) as fin:
+        return sum(1 for line in fin if not line.startswith("#"))
+
+
+def get_variant_type(ref, alts, info=""):
+    """Return the type of a variant (snp, mnp, indel or complex)
+
+    The freebayes TYPE field is used if present (INFO column). Otherwise,
+    the type is deduced from the length of the alleles. Variants with
+    alternate alleles of different types are complex.
+
+    :param ref: the reference allele
+    :param alts: alternate alleles separated by commas
+    :param info: the INFO column
+    """
+    types = None
+    for field in info.split(";"):
+        if field.startswith("TYPE="):
+            types = set(field[5:].split(","))
+    if types is None:
+        types = set()
+        for alt in alts.split(","):
+            if len(alt) == len(ref):
+                types.add("snp" if len(ref) == 1 else "mnp")
+            else:
+                types.add("indel")
+    types = {"indel" if x in ("ins", "del") else x for x in types}
+    if len(types) == 1 and types <= set(VARIANT_TYPES):
+        return types.pop()
+    return "complex"
+
+
+def get_variant_stats(filename):
+    """Count the variants of a VCF file by type (single pass, no VCF parser)
+
+    :return: dictionary with the total number of variants and the number of
+        variants of each type (see :data:`VARIANT_TYPES`).
+    """
+    stats = dict.fromkeys(["variants"] + VARIANT_TYPES, 0)
+    with _open_vcf(filename) as fin:
+        for line in fin:
+            if not line.startswith("#"):
+                fields = line.split("\t", 8)
+                stats[get_variant_type(fields[3], fields[4], fields[7])] += 1
+                stats["variants"] += 1
+    return stats
+
+
+def write_variant_stats(output, sample, raw_count, filtered_vcf):
+    """Save the statistics of a sample (CSV file with a single row)
+
+    Columns are the sample name, the number of raw and filtered variants and
+    the number of filtered variants of each type.
+    """
+    import pandas as pd
+
+    stats = get_variant_stats(filtered_vcf)
+    row = {"name": sample, "raw": raw_count, "filter": stats.pop("variants"), **stats}
+    pd.DataFrame([row]).to_csv(output, index=False)
+
+
+def merge_variant_stats(filenames, output):
+    """Merge the statistics of all samples (see :func:`write_variant_stats`)"""
+    import pandas as pd
+
+    df = pd.concat([pd.read_csv(x) for x in filenames]).sort_values("name")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    df.to_csv(output, index=False)
+
+
+class VariantTable:
+    """Variants of a freebayes VCF file stored in columns
+
+    The table is a dataframe with the columns of the sequana report (one row
+    per variant) and the values used by the filter (columns starting with an
+    underscore). The VCF records are not stored: the filtered VCF is created
+    from the source VCF file (lines of the selected variants).
+
+    :param df: the dataframe (see :meth:`from_vcf`)
+    :param samples: list of samples
+    :param filename: the source VCF file
+    """
+
+    # values used by the filter
+    FILTER_COLUMNS = ["_qual", "_depth", "_forward", "_reverse", "_frequency", "_strand", "_nalts"]
+
+    def __init__(self, df, samples, filename):
+        self.df = df
+        self.samples = samples
+        self.filename = filename
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def is_joint(self):
+        return len(self.samples) > 1
+
+    @classmethod
+    def from_vcf(cls, filename):
+        """Parse a VCF file (plain or compressed)"""
+        import pandas as pd
+        import pysam
+        from sequana.freebayes_vcf_filter import VCF_freebayes
+        from sequana.vcftools import compute_frequency, compute_strand_balance
+
+        vcf = VCF_freebayes(filename)
+        rows = []
+        values = {key: [] for key in cls.FILTER_COLUMNS}
+        with pysam.VariantFile(filename) as fin:
+            for i, variant in enumerate(fin):
+                # same IDs as sequana
+                variant.id = str(i + 1)
+                rows.append(vcf._variant_to_dict(variant))
+                info = variant.info
+                frequency = compute_frequency(variant)
+                values["_qual"].append(variant.qual or 0)
+                values["_depth"].append(info.get("DP", 0))
+                values["_forward"].append(info.get("SRF", 0) + sum(info.get("SAF", ())))
+                values["_reverse"].append(info.get("SRR", 0) + sum(info.get("SAR", ())))
+                values["_frequency"].append(frequency[0] if frequency else np.nan)
+                values["_strand"].append(compute_strand_balance(variant)[0])
+                values["_nalts"].append(len(variant.alts or ()))
+
+        df = pd.DataFrame(rows)
+        for key, value in values.items():
+            df[key] = np.array(value, dtype=float)
+        return cls(df, list(vcf.samples), filename)
+
+    def save(self, filename):
+        """Save the table (pickle of the dataframe)"""
+        self.df.attrs.update({"samples": self.samples, "filename": self.filename})
+        self.df.to_pickle(filename)
+
+    @classmethod
+    def load(cls, filename):
+        import pandas as pd
+
+        df = pd.read_pickle(filename)
+        return cls(df, df.attrs["samples"], df.attrs["filename"])
+
+    def flag_regions(self, intervals):
+        """Flag the variants of some regions in a new 'capped_region' column
+
+        The column is saved in the CSV file and shown in the HTML report. If
+        intervals overlap, 'skip_coverage' takes precedence over
+        'limit_coverage', which takes precedence over the other reasons.
+
+        :param intervals: list of (chrom, start, end, reason) with 0-based
+            start (BED coordinates), e.g. the intervals split or skipped by the
+            guarded freebayes calling.
+        """
+        df = self.df
+        flags = np.full(len(df), "", dtype=object)
+        rank = {"limit_coverage": 1, "skip_coverage": 2}
+        intervals = sorted(intervals, key=lambda x: rank.get(x[3], 0))
+        for chrom, start, end, reason in intervals:
+            mask = (df["chr"] == chrom) & (df["position"] > start) & (df["position"] <= end)
+            flags[mask.to_numpy()] = reason
+        # before the genotype and filter columns
+        if "capped_region" in df.columns:
+            del df["capped_region"]
+        position = list(df.columns).index(self.FILTER_COLUMNS[0]) - len(self.samples)
+        df.insert(position, "capped_region", flags)
+
+    def get_mask(self, filter_dict):
+        """Return a boolean array with the variants that pass the filter
+
+        Same criteria as sequana (only the score and depth for joint calling).
+        """
+        params = {key: filter_dict.get(key, value) for key, value in FILTER_DEFAULTS.items()}
+        df = self.df
+        mask = (df["_qual"] >= params["freebayes_score"]) & (df["_depth"] > params["min_depth"])
+        if not self.is_joint:
+            mask &= df["_forward"] > params["forward_depth"]
+            mask &= df["_reverse"] > params["reverse_depth"]
+            mask &= df["_frequency"] >= params["frequency"]
+            mask &= df["_strand"] >= params["strand_ratio"]
+            if params["keep_polymorphic"] is False:
+                mask &= df["_nalts"] <= 1
+        return mask.to_numpy()
+
+    def filter(self, filter_dict, output_vcf, output_csv=None, report_dir=None):
+        """Save the filtered variants (see :func:`filter_vcf` for the parameters)
+
+        :return: the number of variants that pass the filter.
+        """
+        params = {key: filter_dict.get(key, value) for key, value in FILTER_DEFAULTS.items()}
+        mask = self.get_mask(params)
+
+        import pysam
+
+        # header (as written by pysam) and lines of the selected variants with
+        # the sequana IDs
+        plain = get_plain_name(output_vcf)
+        with _open_vcf(self.filename) as fin, open(plain, "w") as fout:
+            with pysam.VariantFile(self.filename) as vcf:
+                fout.write(str(vcf.header))
+            i = 0
+            for line in fin:
+                if line.startswith("#"):
+                    continue
+                if mask[i]:
+                    fields = line.split("\t", 3)
+                    fields[2] = str(i + 1)
+                    fout.write("\t".join(fields))
+                i += 1
+        compress_vcf(plain, output_vcf)
+
+        # report columns of the selected variants
+        df = self.df.loc[mask, [x for x in self.df.columns if x not in self.FILTER_COLUMNS]]
+        df = df.reset_index(drop=True)
+
+        if output_csv:
+            # the genotype columns are not saved (same as sequana)
+            columns = df.columns[: len(df.columns) - len(self.samples)]
+            with open(output_csv, "w") as fout:
+                print(f"# sequana_variant_calling;{params}", file=fout)
+                if df.empty:
+                    print(",".join(columns), file=fout)
+                else:
+                    df.to_csv(fout, index=False, columns=columns)
+
+        if report_dir:
+            from sequana.modules_report.variant_calling import VariantCallingModule
+            from sequana.utils import config
+
+            config.output_dir = report_dir
+            VariantCallingModule(SimpleNamespace(df=df, vcf=SimpleNamespace(filters_params=params)))
+        return int(mask.sum())
+
+
+def filter_vcf(filename, output_vcf, filter_dict, output_csv=None, report_dir=None):
+    """Filter a freebayes VCF file (same as sequana html-report)
+
+    :param filename: the input VCF (plain or compressed)
+    :param output_vcf: the filtered VCF. Compressed and indexed if it ends
+        with .gz
+    :param dict filter_dict: the filter parameters. Missing parameters are
+        set to their default values (see :data:`FILTER_DEFAULTS`)
+    :param output_csv: if provided, the filtered variants are saved in a CSV file.
+    :param report_dir: if provided, the HTML report (variant_calling.html) is
+        created in this directory.
+    """
+    return VariantTable.from_vcf(filename).filter(filter_dict, output_vcf, output_csv=output_csv, report_dir=report_dir)
@@ -0,0 +1,77 @@
+import gzip
+import os
+import tempfile
+
+import pysam
+
+from sequana_pipelines.variant_calling.benchmark import (
+    collect_benchmarks,
+    compare_to_baseline,
+    generate_dataset,
+    get_scenario,
+    update_config,
+)
+
+
+def test_generate_dataset():
+    scenario = get_scenario("small", samples=2, depth=5, reference_length=20000, contigs=2)
+    with tempfile.TemporaryDirectory() as wk:
+        generate_dataset(wk, scenario)
+        with pysam.FastaFile(f"{wk}/reference.fa") as fasta:
+            assert list(fasta.references) == ["contig1", "contig2"] and sum(fasta.lengths) == 20000
+            reference = {x: fasta.fetch(x) for x in fasta.references}
+
+        # depth of 5 with reads of 100 bases
+        with gzip.open(f"{wk}/S1_R1_.fastq.gz", "rt") as fin:
+            assert sum(1 for _ in fin) == 4 * 500
+        assert os.path.exists(f"{wk}/S2_R2_.fastq.gz")
+
+        with pysam.VariantFile(f"{wk}/truth.vcf") as vcf:
+            assert list(vcf.header.samples) == ["S1", "S2"]
+            variants = list(vcf)
+        assert len(variants) == 20
+        assert all(reference[x.chrom][x.pos - 1] == x.ref != x.alts[0] for x in variants)
+
+        # the dataset is not generated again
+        mtime = os.path.getmtime(f"{wk}/S1_R1_.fastq.gz")
+        generate_dataset(wk, scenario)
+        assert os.path.getmtime(f"{wk}/S1_R1_.fastq.gz") == mtime
+
+        # another scenario with fewer samples: files of S2 are removed
+        generate_dataset(wk, dict(scenario, samples=1))
+        assert not os.path.exists(f"{wk}/S2_R1_.fastq.gz")
+        with pysam.VariantFile(f"{wk}/truth.vcf") as vcf:
+            assert list(vcf.header.samples) == ["S1"]
+
+        # interrupted run (no dataset.json): the dataset is generated again
+        os.remove(f"{wk}/dataset.json")
+        generate_dataset(wk, dict(scenario, samples=1))
+        assert os.path.exists(f"{wk}/dataset.json")
+
+
+def test_benchmarks():
+    header = "s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n"
+    with tempfile.TemporaryDirectory() as wk:
+        for name, values in (
+            ("bwa/A", (10, 200, 50, 9)),
+            ("bwa/B", (30, 100, 150, 29)),
+            ("stats/all", (1, "NA", 0, 1)),
+        ):
+            os.makedirs(os.path.dirname(f"{wk}/{name}"), exist_ok=True)
+            with open(f"{wk}/{name}.tsv", "w") as fout:
+                s, rss, io_out, cpu = values
+                fout.write(header + f"{s}\t0:00:00\t{rss}\t0\t0\t0\t0\t{io_out}\t0\t{cpu}\n")
+
+        results = collect_benchmarks(wk)
+        assert results["bwa"] == {"jobs": 2, "wall": 40, "max_wall": 30, "cpu": 38, "max_rss": 200, "io_out": 200}
+        assert results["stats"]["max_rss"] == 0
+
+    baseline = {"bwa": {"wall": 20, "cpu": 38, "max_rss": 200, "io_out": 200}, "stats": {"wall": 0.5}}
+    # short jobs are not reported
+    assert compare_to_baseline(results, baseline) == [("bwa", "wall", 20, 40)]
+
+
+def test_update_config():
+    config = {"freebayes": {"chunksize": 1000, "ploidy": 1}, "general": {"aligner_choice": "bwa"}}
+    update_config(config, {"freebayes": {"chunksize": 10}})
+    assert config["freebayes"] == {"chunksize": 10, "ploidy": 1}
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+
+from sequana_pipelines.variant_calling.cache import IndexCache, get_cache_key
+
+
+def test_cache_key():
+    with tempfile.TemporaryDirectory() as wk:
+        for name in ("ref1.fa", "ref2.fa"):
+            with open(f"{wk}/{name}", "w") as fout:
+                fout.write(">chr1\nACGT\n")
+
+        # same content, different names
+        key = get_cache_key([f"{wk}/ref1.fa"], algorithm="is")
+        assert key == get_cache_key([f"{wk}/ref2.fa"], algorithm="is")
+        assert key != get_cache_key([f"{wk}/ref1.fa"], algorithm="bwtsw")
+
+
+def test_index_cache():
+    with tempfile.TemporaryDirectory() as wk:
+        cache = IndexCache(f"{wk}/cache", max_size=5e-7)
+        os.makedirs(f"{wk}/project1")
+        os.makedirs(f"{wk}/project2")
+
+        # first project populates the cache
+        files = {"ref.bwt": f"{wk}/project1/ref.bwt"}
+        with cache.lock("bwa", "key1"):
+            assert cache.fetch("bwa", "key1", files) is False
+            with open(files["ref.bwt"], "w") as fout:
+                fout.write("A" * 1000)
+            cache.store("bwa", "key1", files)
+        assert cache.evict(keep=[("bwa", "key1")]) == []
+
+        # second project reuses the files
+        files = {"ref.bwt": f"{wk}/project2/other.bwt"}
+        assert cache.fetch("bwa", "key1", files) is True
+        with open(files["ref.bwt"]) as fin:
+            assert fin.read() == "A" * 1000
+
+        # a new entry exceeds the size limit but the oldest one is linked in project2
+        os.utime(cache.get_entry("bwa", "key1"), (0, 0))
+        with open(f"{wk}/project2/ref.fai", "w") as fout:
+            fout.write("chr1\t4\n")
+        cache.store("fai", "key2", {"ref.fai": f"{wk}/project2/ref.fai"})
+        assert cache.evict(keep=[("fai", "key2")]) == []
+
+        # no more links: the oldest entry is removed
+        os.remove(f"{wk}/project2/other.bwt")
+        assert cache.evict(keep=[("fai", "key2")]) == [("bwa", "key1")]
+        assert cache.get_entries() == [("fai", "key2")]
+
+
+def test_cache_other_file_system(monkeypatch):
+    with tempfile.TemporaryDirectory() as wk:
+        cache = IndexCache(f"{wk}/cache", max_size=1e-7)
+        with open(f"{wk}/ref.bwt", "w") as fout:
+            fout.write("A" * 1000)
+        cache.store("bwa", "key1", {"ref.bwt": f"{wk}/ref.bwt"})
+
+        # no hard links across file systems: files are copied
+        def link(source, target):
+            raise OSError("Invalid cross-device link")
+
+        monkeypatch.setattr(os, "link", link)
+        assert cache.fetch("bwa", "key1", {"ref.bwt": f"{wk}/project.bwt"})
+        assert not os.path.islink(f"{wk}/project.bwt")
+
+        # the copy does not depend on the cache
+        assert cache.evict() == [("bwa", "key1")]
+        with open(f"{wk}/project.bwt") as fin:
+            assert fin.read() == "A" * 1000
+
+
+def test_cache_directory():
+    with tempfile.TemporaryDirectory() as wk:
+        cache = IndexCache(f"{wk}/cache")
+        os.makedirs(f"{wk}/project1/database/ref")
+        with open(f"{wk}/project1/database/ref/snpEffectPredictor.bin", "w") as fout:
+            fout.write("data")
+        cache.store("snpeff", "key", {"snpeff": f"{wk}/project1/database"})
+
+        # directories are re-created with hard links (not symlinked)
+        assert cache.fetch("snpeff", "key", {"snpeff": f"{wk}/project2_database"})
+        assert not os.path.islink(f"{wk}/project2_database")
+        assert os.stat(f"{wk}/project2_database/ref/snpEffectPredictor.bin").st_nlink == 2
+
+        # the database used by project2 is not evicted
+        cache.max_size = 1e-9
+        assert cache.evict() == []
+        shutil.rmtree(f"{wk}/project2_database")
+        assert cache.evict() == [("snpeff", "key")]
+
+
+def test_cache_time():
+    with tempfile.TemporaryDirectory() as wk:
+        cache = IndexCache(f"{wk}/cache")
+        with open(f"{wk}/ref.bwt", "w") as fout:
+            fout.write("A" * 1000)
+        cache.store("bwa", "key1", {"ref.bwt": f"{wk}/ref.bwt"})
+        os.makedirs(f"{wk}/database/ref")
+        with open(f"{wk}/database/ref/snpEffectPredictor.bin", "w") as fout:
+            fout.write("data")
+        cache.store("snpeff", "key2", {"snpeff": f"{wk}/database"})
+
+        # project1 uses the cache
+        assert cache.fetch("bwa", "key1", {"ref.bwt": f"{wk}/project1.bwt"})
+        assert cache.fetch("snpeff", "key2", {"snpeff": f"{wk}/project1_database"})
+        os.utime(f"{wk}/project1.bwt", (0, 0))
+        os.utime(f"{wk}/project1_database/ref/snpEffectPredictor.bin", (0, 0))
+
+        # project2 fetches the same entries later: the time of project1's
+        # files (shared with the cache) is unchanged
+        assert cache.fetch("bwa", "key1", {"ref.bwt": f"{wk}/project2.bwt"})
+        assert cache.fetch("snpeff", "key2", {"snpeff": f"{wk}/project2_database"})
+        assert os.path.getmtime(f"{wk}/project1.bwt") == 0
+        assert os.path.getmtime(f"{wk}/project1_database/ref/snpEffectPredictor.bin") == 0
@@ -0,0 +1,134 @@
+import os
+import tempfile
+
+import pysam
+
+from sequana_pipelines.variant_calling import depth
+from sequana_pipelines.variant_calling.depth import create_double_bed
+
+
+def create_bam(filename, contigs, reads):
+    # reads are (contig, position, cigar, flag)
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": n, "LN": l} for n, l in contigs]}
+    with pysam.AlignmentFile(filename, "wb", header=header) as fout:
+        for i, (contig, pos, cigar, flag) in enumerate(reads):
+            read = pysam.AlignedSegment(fout.header)
+            read.query_name = f"read{i}"
+            read.flag = flag
+            read.reference_name = contig
+            read.reference_start = pos
+            read.mapping_quality = 60
+            read.cigarstring = cigar
+            read.query_sequence = "A" * read.infer_query_length()
+            fout.write(read)
+
+
+def read_bed(filename):
+    with open(filename) as fin:
+        return [line.split() for line in fin]
+
+
+CONTIGS = [("chr1", 20), ("chr2", 10), ("chr3", 5)]
+READS = [
+    ("chr1", 0, "5M", 0),
+    ("chr1", 2, "3M2D3M", 0),
+    # duplicates are only counted in the 4th column
+    ("chr1", 10, "4M", 1024),
+    ("chr2", 5, "5M", 0),
+]
+
+
+def create_data(wk):
+    create_bam(f"{wk}/test.bam", CONTIGS, READS)
+    with open(f"{wk}/ref.fa.fai", "w") as fout:
+        for name, length in CONTIGS:
+            fout.write(f"{name}\t{length}\t0\t60\t61\n")
+
+
+def test_double_bed():
+    with tempfile.TemporaryDirectory() as wk:
+        create_data(wk)
+
+        create_double_bed(f"{wk}/test.bam", f"{wk}/ref.fa.fai", f"{wk}/double.bed")
+        data = read_bed(f"{wk}/double.bed")
+
+        assert len(data) == 35
+        assert data[0] == ["chr1", "1", "1", "1"]
+        depth1 = [int(x[2]) for x in data[:20]]
+        depth2 = [int(x[3]) for x in data[:20]]
+        assert depth1[:11] == [1, 1, 2, 2, 2, 0, 0, 1, 1, 1, 0]
+        assert depth2[:11] == [1, 1, 2, 2, 2, 1, 1, 1, 1, 1, 1]
+        assert depth1[10:14] == [0] * 4
+        assert depth2[10:14] == [1] * 4
+        assert data[25] == ["chr2", "6", "1", "1"]
+        assert data[-1] == ["chr3", "5", "0", "0"]
+
+        # without index, the file is read in a single pass (no index created)
+        create_double_bed(f"{wk}/test.bam", f"{wk}/ref.fa.fai", f"{wk}/double2.bed", threads=2)
+        assert not os.path.exists(f"{wk}/test.bam.bai")
+        assert read_bed(f"{wk}/double2.bed") == data
+
+        # same results with several processes
+        pysam.index(f"{wk}/test.bam")
+        create_double_bed(f"{wk}/test.bam", f"{wk}/ref.fa.fai", f"{wk}/double2.bed", threads=2)
+        assert read_bed(f"{wk}/double2.bed") == data
+
+        # CRAM files are decoded with the reference
+        with open(f"{wk}/genome.fa", "w") as fout:
+            for name, length in CONTIGS:
+                fout.write(f">{name}\n" + "A" * length + "\n")
+        pysam.view("-C", "-T", f"{wk}/genome.fa", "-o", f"{wk}/test.cram", f"{wk}/test.bam", catch_stdout=False)
+        create_double_bed(
+            f"{wk}/test.cram", f"{wk}/ref.fa.fai", f"{wk}/double3.bed", threads=2, reference=f"{wk}/genome.fa"
+        )
+        assert not os.path.exists(f"{wk}/test.cram.crai")
+        assert read_bed(f"{wk}/double3.bed") == data
+        pysam.index(f"{wk}/test.cram")
+        create_double_bed(
+            f"{wk}/test.cram", f"{wk}/ref.fa.fai", f"{wk}/double3.bed", threads=2, reference=f"{wk}/genome.fa"
+        )
+        assert read_bed(f"{wk}/double3.bed") == data
+
+
+def test_double_bed_chunks(monkeypatch):
+    # depths computed by chunks of 3 positions, contigs of the BAM header in
+    # another order than the FASTA index and a spliced read (the reference
+    # skip is only counted in the 4th column, as bedtools genomecov -d)
+    monkeypatch.setattr(depth, "_CHUNKSIZE", 3)
+    reads = [
+        ("chr2", 0, "4M", 0),
+        ("chr2", 1, "2M5N2M", 0),
+        ("chr1", 0, "5M", 0),
+        ("chr1", 2, "3M2D3M", 0),
+        ("chr1", 10, "4M", 1024),
+    ]
+    header = [CONTIGS[1], CONTIGS[0], CONTIGS[2]]
+
+    expected = []
+    for name, length in CONTIGS:
+        depth1, depth2 = [0] * length, [0] * length
+        for contig, pos, cigar, flag in reads:
+            if contig != name:
+                continue
+            read = pysam.AlignedSegment()
+            read.reference_start, read.cigarstring = pos, cigar
+            for start, end in read.get_blocks():
+                for i in range(start, end):
+                    depth1[i] += 0 if flag else 1
+            for i in range(pos, read.reference_end):
+                depth2[i] += 1
+        expected += [[name, str(i + 1), str(x), str(y)] for i, (x, y) in enumerate(zip(depth1, depth2))]
+
+    with tempfile.TemporaryDirectory() as wk:
+        create_bam(f"{wk}/test.bam", header, reads)
+        with open(f"{wk}/ref.fa.fai", "w") as fout:
+            for name, length in CONTIGS:
+                fout.write(f"{name}\t{length}\t0\t60\t61\n")
+
+        create_double_bed(f"{wk}/test.bam", f"{wk}/ref.fa.fai", f"{wk}/double.bed")
+        assert read_bed(f"{wk}/double.bed") == expected
+        assert sorted(os.listdir(wk)) == ["double.bed", "ref.fa.fai", "test.bam"]
+
+        pysam.index(f"{wk}/test.bam")
+        create_double_bed(f"{wk}/test.bam", f"{wk}/ref.fa.fai", f"{wk}/double2.bed", threads=2)
+        assert read_bed(f"{wk}/double2.bed") == expected
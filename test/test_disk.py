@@ -0,0 +1,41 @@
+import os
+import tempfile
+import time
+
+from sequana_pipelines.variant_calling.disk import DiskMonitor, get_disk_usage
+
+
+def write_file(filename, size):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "wb") as fout:
+        fout.write(os.urandom(size))
+
+
+def test_disk_usage():
+    with tempfile.TemporaryDirectory() as wk:
+        write_file(f"{wk}/A/bwa/A.bam", 100000)
+        write_file(f"{wk}/A/freebayes/A.vcf", 50000)
+        os.symlink(f"{wk}/A/bwa/A.bam", f"{wk}/A/link.bam")
+        usage = get_disk_usage(f"{wk}/A")
+        # symbolic links are not followed
+        assert 150000 <= usage < 200000
+        assert get_disk_usage(f"{wk}/missing") == 0
+
+
+def test_disk_monitor():
+    with tempfile.TemporaryDirectory() as wk:
+        monitor = DiskMonitor({"A": f"{wk}/A", "B": f"{wk}/B"}, interval=0.05)
+        monitor.start()
+        write_file(f"{wk}/A/A.bam", 200000)
+        write_file(f"{wk}/B/B.bam", 100000)
+        time.sleep(0.3)
+        # intermediate file removed
+        os.remove(f"{wk}/A/A.bam")
+        write_file(f"{wk}/A/A.vcf", 10000)
+        time.sleep(0.3)
+        monitor.stop()
+
+        summary = monitor.summary()
+        assert summary["directories"]["A"] >= 200000 and summary["directories"]["B"] >= 100000
+        assert summary["peak"] >= 300000
+        assert summary["final"] < 200000 and summary["measurements"] > 2
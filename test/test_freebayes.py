@@ -0,0 +1,120 @@
+import json
+import math
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from sequana_pipelines.variant_calling import freebayes
+
+from .test_regions import create_bam
+
+HEADER = "##fileformat=VCFv4.2\n##contig=<ID=chr1,length=100000>\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def test_coverage():
+    # uniform coverage of 10 (reads of 100 bases every 10 bases) and a hotspot
+    contigs = [("chr1", 160_000)]
+    positions = [("chr1", i) for i in range(0, 159_900, 10)]
+    positions += [("chr1", 50_000)] * 20_000
+    with tempfile.TemporaryDirectory() as wk:
+        create_bam(f"{wk}/test.bam", contigs, positions)
+        coverage = freebayes.get_coverage(f"{wk}/test.bam", contigs)
+        assert coverage["mean"] > 20
+        assert 5 < coverage["median"] < 15
+
+        with open(f"{wk}/coverage.json", "w") as fout:
+            json.dump(coverage, fout)
+        assert freebayes.get_coverage_cap(f"{wk}/coverage.json", 10, min_coverage=10) == math.ceil(
+            10 * coverage["median"]
+        )
+        assert freebayes.get_coverage_cap(f"{wk}/coverage.json", 10, min_coverage=1000) == 1000
+
+        # windows above the cap: the hotspot only
+        capped = freebayes.get_coverage(f"{wk}/test.bam", contigs, factor=5, min_coverage=10)
+        assert capped["cap"] == math.ceil(5 * coverage["median"])
+        assert capped["limit_coverage"] == [["chr1", 49152, 65536]]
+        with open(f"{wk}/coverage.json", "w") as fout:
+            json.dump(capped, fout)
+        limited = freebayes.get_limited_intervals(f"{wk}/coverage.json", [("chr1", 0, 50000), ("chr1", 60000, 100000)])
+        assert limited == [("chr1", 49152, 50000, "limit_coverage"), ("chr1", 60000, 65536, "limit_coverage")]
+
+        # without index, the reads are counted (same estimates)
+        os.remove(f"{wk}/test.bam.bai")
+        unindexed = freebayes.get_coverage(f"{wk}/test.bam", contigs, factor=5, min_coverage=10)
+        assert unindexed["mean"] == pytest.approx(coverage["mean"])
+        assert 5 < unindexed["median"] < 15
+        assert unindexed["limit_coverage"] == [["chr1", 49152, 65536]]
+        assert not os.path.exists(f"{wk}/test.bam.bai")
+
+
+def test_budget_exceeded():
+    # timeout, killed (out of memory) or allocation above ulimit -v
+    assert freebayes.budget_exceeded(124) and freebayes.budget_exceeded(137) and freebayes.budget_exceeded(-9)
+    assert freebayes.budget_exceeded(134, "terminate called after throwing an instance of 'std::bad_alloc'")
+    # bad option, missing binary
+    assert not freebayes.budget_exceeded(1, "unrecognized option")
+    assert not freebayes.budget_exceeded(127, "freebayes: command not found")
+
+
+def test_split_intervals():
+    assert freebayes.split_intervals([("chr1", 0, 100)]) == [[("chr1", 0, 50)], [("chr1", 50, 100)]]
+    assert freebayes.split_intervals([("chr1", 0, 30), ("chr2", 0, 70)]) == [
+        [("chr1", 0, 30), ("chr2", 0, 20)],
+        [("chr2", 20, 70)],
+    ]
+
+
+def test_call_guarded():
+    # the budget is exceeded by regions of more than 30kb and around the
+    # hotspot at position 50000, which is finally skipped
+    calls = []
+
+    def run(bed, vcf, last_resort):
+        intervals = freebayes.read_bed(bed)
+        calls.append((intervals, last_resort))
+        length = sum(end - start for _, start, end in intervals)
+        hotspot = any(start <= 50_000 < end for _, start, end in intervals)
+        if not last_resort and (length > 30_000 or hotspot):
+            return False
+        with open(vcf, "w") as fout:
+            fout.write(HEADER)
+            for chrom, start, end in intervals:
+                fout.write(f"{chrom}\t{start + 1}\t.\tA\tT\t50\t.\t.\n")
+        return True
+
+    with tempfile.TemporaryDirectory() as wk:
+        with open(f"{wk}/region.bed", "w") as fout:
+            fout.write("chr1\t0\t100000\n")
+
+        capped = freebayes.call_guarded(run, f"{wk}/region.bed", f"{wk}/out.vcf.gz", threads=2, min_length=10000)
+        assert ("chr1", 0, 100000, "split") in capped
+        skipped = [x for x in capped if x[3] == "skip_coverage"]
+        assert len(skipped) == 1 and skipped[0][1] <= 50_000 < skipped[0][2]
+
+        # sub-regions are merged in the reference order
+        import pysam
+
+        with pysam.VariantFile(f"{wk}/out.vcf.gz") as vcf:
+            positions = [x.pos for x in vcf]
+        assert positions == sorted(positions) and positions[0] == 1
+
+        freebayes.write_capped(capped, f"{wk}/capped.bed")
+        assert freebayes.read_capped(f"{wk}/capped.bed") == capped
+
+
+def test_call_guarded_error():
+    # errors other than the budget are raised (the region is not split)
+    calls = []
+
+    def run(bed, vcf, last_resort):
+        calls.append(bed)
+        raise subprocess.CalledProcessError(1, "freebayes --bad-option")
+
+    with tempfile.TemporaryDirectory() as wk:
+        with open(f"{wk}/region.bed", "w") as fout:
+            fout.write("chr1\t0\t100000\n")
+        with pytest.raises(subprocess.CalledProcessError):
+            freebayes.call_guarded(run, f"{wk}/region.bed", f"{wk}/out.vcf", threads=2)
+        assert len(calls) == 1
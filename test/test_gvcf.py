@@ -0,0 +1,136 @@
+import tempfile
+
+import pysam
+
+from sequana_pipelines.variant_calling.gvcf import merge_gvcfs
+
+HEADER = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=10000>
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Total read depth">
+##INFO=<ID=END,Number=1,Type=Integer,Description="Last position of the block">
+##INFO=<ID=MIN_DP,Number=1,Type=Integer,Description="Minimum depth in the block">
+##INFO=<ID=RO,Number=1,Type=Integer,Description="Reference observations">
+##INFO=<ID=AO,Number=A,Type=Integer,Description="Alternate observations">
+##INFO=<ID=SRF,Number=1,Type=Integer,Description="Reference forward">
+##INFO=<ID=SRR,Number=1,Type=Integer,Description="Reference reverse">
+##INFO=<ID=SAF,Number=A,Type=Integer,Description="Alternate forward">
+##INFO=<ID=SAR,Number=A,Type=Integer,Description="Alternate reverse">
+##INFO=<ID=TYPE,Number=A,Type=String,Description="Type of allele">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">
+##FORMAT=<ID=MIN_DP,Number=1,Type=Integer,Description="Minimum depth in the block">
+##FORMAT=<ID=RO,Number=1,Type=Integer,Description="Reference observations">
+##FORMAT=<ID=AO,Number=A,Type=Integer,Description="Alternate observations">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{sample}
+"""
+
+SAMPLE_A = [
+    "chr1\t1\t.\tA\t<*>\t0\t.\tDP=200;END=99;MIN_DP=20\tGT:DP:MIN_DP\t0:200:20",
+    "chr1\t100\t.\tC\tT\t500\t.\tDP=30;RO=2;AO=28;SRF=1;SRR=1;SAF=14;SAR=14;TYPE=snp\tGT:DP:RO:AO\t1:30:2:28",
+    "chr1\t101\t.\tA\t<*>\t0\t.\tDP=400;END=1000;MIN_DP=25\tGT:DP:MIN_DP\t0:400:25",
+]
+
+SAMPLE_B = [
+    "chr1\t1\t.\tA\t<*>\t0\t.\tDP=200;END=499;MIN_DP=12\tGT:DP:MIN_DP\t0:200:12",
+    "chr1\t500\t.\tG\tA\t300\t.\tDP=20;RO=0;AO=20;SRF=0;SRR=0;SAF=10;SAR=10;TYPE=snp\tGT:DP:RO:AO\t1:20:0:20",
+]
+
+
+def write_gvcf(filename, sample, lines):
+    with open(filename, "w") as fout:
+        fout.write(HEADER.replace("{sample}", sample).replace("\\t", "\t"))
+        fout.write("\n".join(lines) + "\n")
+
+
+def test_merge_gvcfs():
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/A.g.vcf", "A", SAMPLE_A)
+        write_gvcf(f"{wk}/B.g.vcf", "B", SAMPLE_B)
+        merge_gvcfs([f"{wk}/A.g.vcf", f"{wk}/B.g.vcf"], f"{wk}/joint.vcf")
+
+        with pysam.VariantFile(f"{wk}/joint.vcf") as vcf:
+            assert list(vcf.header.samples) == ["A", "B"]
+            records = list(vcf)
+
+        assert [(x.pos, x.ref, x.alts) for x in records] == [(100, "C", ("T",)), (500, "G", ("A",))]
+
+        # sample B is covered by a reference block at position 100
+        first = records[0]
+        assert first.samples["A"]["GT"] == (1,)
+        assert first.samples["B"]["GT"] == (0,)
+        assert first.samples["B"]["DP"] == 12
+        assert first.info["DP"] == 42
+        assert first.info["AO"] == (28,)
+        assert first.qual == 500
+
+        # sample A is also reference at position 500
+        second = records[1]
+        assert second.samples["A"]["GT"] == (0,)
+        assert second.samples["A"]["DP"] == 25
+        assert second.samples["B"]["GT"] == (1,)
+
+
+def test_merge_gvcfs_missing_and_alleles():
+    # sample B has another allele at the same position and no block elsewhere
+    sample_b = ["chr1\t100\t.\tC\tG\t50\t.\tDP=10;RO=5;AO=5;SRF=2;SRR=3;SAF=2;SAR=3;TYPE=snp\tGT:DP:RO:AO\t1:10:5:5"]
+    sample_c = ["chr1\t2000\t.\tA\t<*>\t0\t.\tDP=100;END=3000;MIN_DP=10\tGT:DP:MIN_DP\t0:100:10"]
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/A.g.vcf", "A", SAMPLE_A)
+        write_gvcf(f"{wk}/B.g.vcf", "B", sample_b)
+        write_gvcf(f"{wk}/C.g.vcf", "C", sample_c)
+        merge_gvcfs([f"{wk}/{x}.g.vcf" for x in "ABC"], f"{wk}/joint.vcf", ploidy=2)
+
+        with pysam.VariantFile(f"{wk}/joint.vcf") as vcf:
+            records = list(vcf)
+        assert len(records) == 1
+        record = records[0]
+        assert record.alts == ("T", "G")
+        assert record.samples["B"]["GT"] == (2,)
+        assert record.samples["B"]["AO"] == (0, 5)
+        assert record.samples["C"]["GT"] == (None, None)
+        assert record.info["AO"] == (28, 5)
+        assert record.info["SAF"] == (14, 2)
+
+
+def test_merge_gvcfs_overlapping_indel():
+    # sample B has a deletion at the SNP of sample A, sample C the same SNP
+    # with a longer REF (freebayes complex representation)
+    sample_b = ["chr1\t100\t.\tCA\tC\t80\t.\tDP=12;RO=2;AO=10;SRF=1;SRR=1;SAF=5;SAR=5;TYPE=del\tGT:DP:RO:AO\t1:12:2:10"]
+    sample_c = [
+        "chr1\t99\t.\tGCA\tGTA\t60\t.\tDP=15;RO=5;AO=10;SRF=2;SRR=3;SAF=5;SAR=5;TYPE=snp\tGT:DP:RO:AO\t1:15:5:10"
+    ]
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/A.g.vcf", "A", SAMPLE_A)
+        write_gvcf(f"{wk}/B.g.vcf", "B", sample_b)
+        write_gvcf(f"{wk}/C.g.vcf", "C", sample_c)
+        merge_gvcfs([f"{wk}/{x}.g.vcf" for x in "ABC"], f"{wk}/joint.vcf")
+
+        with pysam.VariantFile(f"{wk}/joint.vcf") as vcf:
+            records = list(vcf)
+        assert len(records) == 1
+        record = records[0]
+        assert (record.pos, record.ref, record.alts) == (100, "CA", ("TA", "C"))
+        assert record.samples["A"]["GT"] == (1,)
+        assert record.samples["B"]["GT"] == (2,)
+        assert record.samples["C"]["GT"] == (1,)
+        assert record.info["AO"] == (38, 10)
+        assert record.info["TYPE"] == ("snp", "del")
+
+
+def test_merge_gvcfs_reference_block_allele():
+    # <*> between the ALT alleles of sample B
+    sample_b = [
+        "chr1\t100\t.\tC\tG,<*>,T\t50\t.\tDP=10;RO=1;AO=5,1,3;SRF=0;SRR=1;SAF=2,0,1;SAR=3,1,2;TYPE=snp,snp,snp\tGT:DP:RO:AO\t1/3:10:1:5,1,3"
+    ]
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/A.g.vcf", "A", SAMPLE_A)
+        write_gvcf(f"{wk}/B.g.vcf", "B", sample_b)
+        merge_gvcfs([f"{wk}/A.g.vcf", f"{wk}/B.g.vcf"], f"{wk}/joint.vcf", ploidy=2)
+
+        with pysam.VariantFile(f"{wk}/joint.vcf") as vcf:
+            record = next(iter(vcf))
+        assert record.alts == ("T", "G")
+        assert record.samples["B"]["GT"] == (2, 1)
+        assert record.samples["B"]["AO"] == (3, 5)
+        assert record.info["AO"] == (31, 5)
+        assert record.info["SAF"] == (15, 2)
@@ -1,6 +1,7 @@
 import os
-import tempfile
 import subprocess
+import sys
+import tempfile
 from sequana_pipelines.variant_calling.main import main
 from click.testing import CliRunner
 
@@ -23,6 +24,17 @@ def test_standalone_subprocess():
 
 
 
+def test_startup():
+    # the CLI (and --help) must start quickly: heavy modules are imported lazily
+    code = (
+        "import sys, time; t = time.time(); import sequana_pipelines.variant_calling.main; "
+        "print(time.time() - t); print(*[x for x in ('sequana', 'pandas', 'pysam', 'snakemake') if x in sys.modules])"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True).split("\n")
+    assert float(output[0]) < 5
+    assert output[1] == ""
+
+
 def test_standalone_script():
 
     wk = tempfile.TemporaryDirectory()
@@ -46,6 +58,23 @@ def test_standalone_script_with_coverage():
 
 
 
+def test_streaming_dryrun():
+    # fastp and the aligner (pipe group) must fit in the cores of the profile
+    import yaml
+
+    with tempfile.TemporaryDirectory() as wk:
+        cmd = f"sequana_variant_calling --input-directory {sharedir} --working-directory {wk} --force --reference-file {reference}"
+        subprocess.check_call(cmd.split())
+        with open(f"{wk}/config.yaml") as fin:
+            cfg = yaml.safe_load(fin)
+        cfg["fastp"]["streaming"] = True
+        with open(f"{wk}/config.yaml", "w") as fout:
+            yaml.safe_dump(cfg, fout)
+
+        cmd = "snakemake -s variant_calling.rules -n --cores 4 data/bwa/data.sorted.bam"
+        subprocess.check_call(cmd.split(), cwd=wk)
+
+
 def test_check_output_ref_annot():
 
     with tempfile.TemporaryDirectory() as wk:
@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+from sequana_pipelines.variant_calling.manifest import get_manifest, write_manifest
+
+
+def test_manifest():
+    with tempfile.TemporaryDirectory() as wk:
+        for name in (
+            "A/fastp/fastp_A.json",
+            "A/fastqc/A_R1_fastqc.zip",
+            "A/fastqc/A_R1_fastqc.html",
+            "B/fastqc/B_R1_fastqc.zip",
+            "A/sequana_coverage/chr1/sequana_summary_coverage.json",
+            "A/freebayes_split/data.chr1.region.1.vcf",
+            "outputs/cram_savings_mqc.tsv",
+        ):
+            os.makedirs(f"{wk}/{os.path.dirname(name)}", exist_ok=True)
+            open(f"{wk}/{name}", "w").close()
+
+        patterns = {
+            "fastp": [f"{wk}/{{sample}}/fastp/fastp_{{sample}}.json"],
+            "fastqc": [f"{wk}/{{sample}}/fastqc/*_fastqc.zip"],
+            "sequana_coverage": [f"{wk}/{{sample}}/sequana_coverage/*/sequana_summary_coverage.json"],
+            "custom_content": [f"{wk}/outputs/cram_savings_mqc.tsv"],
+        }
+        files = get_manifest(patterns, ["A", "B"])
+        assert [os.path.relpath(x, wk) for x in files] == [
+            "A/fastp/fastp_A.json",
+            "A/fastqc/A_R1_fastqc.zip",
+            "A/sequana_coverage/chr1/sequana_summary_coverage.json",
+            "B/fastqc/B_R1_fastqc.zip",
+            "outputs/cram_savings_mqc.tsv",
+        ]
+
+        # patterns of the other modules are ignored
+        assert write_manifest(patterns, ["A", "B"], f"{wk}/manifest.txt", modules=["fastqc"]) == 2
+        with open(f"{wk}/manifest.txt") as fin:
+            assert fin.read() == f"{wk}/A/fastqc/A_R1_fastqc.zip\n{wk}/B/fastqc/B_R1_fastqc.zip\n"
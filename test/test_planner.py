@@ -0,0 +1,119 @@
+import os
+import tempfile
+
+from sequana_pipelines.variant_calling.planner import (
+    ResourcePlanner,
+    get_makespan_summary,
+)
+
+
+def write_data(wk):
+    # a 10kb reference with its index, 2 samples of 1 and 3 MB
+    with open(f"{wk}/ref.fa", "w") as fout:
+        fout.write(">chr1\n" + "A" * 10000 + "\n")
+    with open(f"{wk}/ref.fa.fai", "w") as fout:
+        fout.write("chr1\t10000\t6\t10000\t10001\n")
+    for name, size in (("A", 1000000), ("B", 3000000)):
+        with open(f"{wk}/{name}.fastq.gz", "wb") as fout:
+            fout.write(b"\0" * size)
+    os.makedirs(f"{wk}/resources/regions")
+    with open(f"{wk}/resources/regions/data.chr1.region.1.bed", "w") as fout:
+        fout.write("chr1\t0\t2500\n")
+    return {"A": [f"{wk}/A.fastq.gz"], "B": [f"{wk}/B.fastq.gz"]}
+
+
+def test_planner_off():
+    planner = ResourcePlanner({}, {"A": ["A.fastq.gz"]}, "ref.fa")
+    assert planner.get_threads("bwa", 4) == 4
+    assert planner.get_resources("bwa", {"mem": "8G"}) == {"mem": "8G"}
+
+
+def test_planner():
+    with tempfile.TemporaryDirectory() as wk:
+        samples = write_data(wk)
+        config = {"resources_planner": {"do": True, "max_mem_mb": 64000, "max_runtime": 4320}}
+        planner = ResourcePlanner(config, samples, f"{wk}/ref.fa", regions_directory=f"{wk}/resources/regions")
+        planner.models["bwa"]["gb_per_thread"] = 0.001
+        planner.models["bwa"]["mem_mb"]["sample"] = 1e6
+
+        # one thread per MB of data, up to the threads of the config file
+        threads = planner.get_threads("bwa", 2)
+        assert threads({"sample": "A"}) == 1
+        assert threads({"sample": "B"}) == 2
+
+        resources = planner.get_resources("bwa", {"mem": "8G", "tmpdir": "tmp"})
+        assert resources["tmpdir"] == "tmp" and "mem" not in resources
+        mem_a = resources["mem_mb"]({"sample": "A"}, 1)
+        assert mem_a < resources["mem_mb"]({"sample": "B"}, 1)
+        assert abs(resources["mem_mb"]({"sample": "A"}, 2) - 2 * mem_a) <= 1
+        assert resources["runtime"]({"sample": "B"}, 1) >= resources["runtime"]({"sample": "B"}, 2)
+
+        # a region is a fraction of the sample, all samples without sample wildcard
+        sizes = planner.get_sizes({"sample": "B", "chrom": "chr1", "chunk": "1"})
+        assert round(sizes["sample"], 6) == 0.00075 and sizes["reference"] == 1e-5
+        assert round(planner.get_sizes({"chrom": "chr1", "chunk": "1"})["sample"], 6) == 0.001
+
+
+def test_planner_calibration():
+    with tempfile.TemporaryDirectory() as wk:
+        samples = write_data(wk)
+        planner = ResourcePlanner({}, samples, f"{wk}/ref.fa", regions_directory=f"{wk}/resources/regions")
+        os.makedirs(f"{wk}/benchmarks/add_read_group")
+        planner.write_sizes(f"{wk}/benchmarks/sizes.json")
+
+        # twice the predicted memory and CPU time
+        predicted = planner.get_sizes({"sample": "A"})
+        mem = 2 * planner.predict("add_read_group", predicted, "mem_mb")
+        cpu = 2 * planner.predict("add_read_group", predicted, "cpu") * 60
+        with open(f"{wk}/benchmarks/add_read_group/A.tsv", "w") as fout:
+            fout.write("s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n")
+            fout.write(f"10\t0:00:10\t{mem}\t0\t0\t0\t0\t0\t0\t{cpu}\n")
+
+        factors = planner.calibrate(wk)
+        assert round(factors["add_read_group"]["mem_mb"], 6) == 2.4
+        assert round(factors["add_read_group"]["cpu"], 6) == 2.4
+        assert round(planner.predict("add_read_group", predicted, "mem_mb"), 6) == round(1.2 * mem, 6)
+        assert "bwa" not in factors
+
+
+def test_priority():
+    with tempfile.TemporaryDirectory() as wk:
+        samples = write_data(wk)
+        planner = ResourcePlanner({}, samples, f"{wk}/ref.fa", regions_directory=f"{wk}/resources/regions")
+        fastp = planner.get_priority("fastp", downstream=["bwa", "freebayes_intermediate"])
+        bwa = planner.get_priority("bwa", downstream=["freebayes_intermediate"])
+        # largest samples first, then the earliest rules
+        assert fastp({"sample": "B"}) > fastp({"sample": "A"}) > bwa({"sample": "A"}) > 0
+        freebayes = planner.get_priority("freebayes_intermediate")
+        assert freebayes({"sample": "B", "chrom": "chr1", "chunk": "1"}) < bwa({"sample": "B"})
+
+        planner = ResourcePlanner({"resources_planner": {"priorities": False}}, samples, f"{wk}/ref.fa")
+        assert planner.get_priority("fastp", downstream=["bwa"]) == 0
+
+
+def test_makespan_summary():
+    with tempfile.TemporaryDirectory() as wk:
+        # two samples of 2 steps and the reference index
+        jobs = [
+            ("bwa_index/reference", 10),
+            ("bwa/A", 40),
+            ("bwa/B", 20),
+            ("freebayes_intermediate/A/data.chr1.region.1", 30),
+            ("freebayes_intermediate/A/data.chr1.region.2", 50),
+            ("freebayes_intermediate/B/data.chr1.region.1", 10),
+        ]
+        for name, seconds in jobs:
+            os.makedirs(os.path.dirname(f"{wk}/{name}"), exist_ok=True)
+            with open(f"{wk}/{name}.tsv", "w") as fout:
+                fout.write("s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n")
+                fout.write(f"{seconds}\t0:00:00\t0\t0\t0\t0\t0\t0\t0\t{seconds}\n")
+
+        summary = get_makespan_summary(wk, 2, 0, end=200)
+        assert summary["cpu_time"] == 160 and summary["work_bound"] == 80
+        # bwa then the longest region of A
+        assert summary["path_bound"] == 90 and summary["lower_bound"] == 90
+        assert summary["efficiency"] == 0.45
+
+        # unknown number of cores (cluster): only the path bound
+        summary = get_makespan_summary(wk, None, 0, end=200)
+        assert summary["work_bound"] is None and summary["lower_bound"] == 90
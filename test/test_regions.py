@@ -0,0 +1,131 @@
+import os
+import tempfile
+
+import pysam
+
+from sequana_pipelines.variant_calling import regions
+
+
+def create_bam(filename, contigs, positions):
+    # single-end reads of 100 bases starting at the given (contig, position)
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": n, "LN": l} for n, l in contigs]}
+    names = [x[0] for x in contigs]
+    with pysam.AlignmentFile(filename, "wb", header=header) as fout:
+        for i, (contig, pos) in enumerate(sorted(positions, key=lambda x: (names.index(x[0]), x[1]))):
+            read = pysam.AlignedSegment(fout.header)
+            read.query_name = f"read{i}"
+            read.reference_name = contig
+            read.reference_start = pos
+            read.mapping_quality = 60
+            read.cigarstring = "100M"
+            read.query_sequence = "ACGT" * 25
+            read.query_qualities = pysam.qualitystring_to_array("I" * 100)
+            fout.write(read)
+    pysam.index(filename)
+
+
+def test_fixed_regions():
+    contigs = [("chr1", 2500), ("chr2", 1000)]
+    shards = regions.get_fixed_regions(contigs, 1000)
+    assert shards == [("chr1", 0, 1000), ("chr1", 1000, 2000), ("chr1", 2000, 2500), ("chr2", 0, 1000)]
+
+
+def test_balanced_regions():
+    contigs = [("chr1", 1_000_000), ("chr2", 200_000)]
+
+    # a hotspot of reads in the first 50kb of chr1, low coverage elsewhere
+    positions = [("chr1", i % 50_000) for i in range(0, 50_000 * 40, 7)]
+    positions += [("chr1", i) for i in range(50_000, 999_000, 500)]
+    positions += [("chr2", i) for i in range(0, 199_000, 500)]
+
+    with tempfile.TemporaryDirectory() as wk:
+        bam = os.path.join(wk, "test.bam")
+        create_bam(bam, contigs, positions)
+        work = regions.get_bam_work(bam, contigs)
+        assert set(work) == {"chr1", "chr2"}
+        assert work["chr1"][:3].sum() > work["chr1"][3:].sum()
+
+        shards = regions.get_balanced_regions(contigs, work, 12)
+
+        # contiguous and covering each contig entirely
+        for name, length in contigs:
+            subset = [x for x in shards if x[0] == name]
+            assert subset[0][1] == 0 and subset[-1][2] == length
+            assert all(a[2] == b[1] for a, b in zip(subset[:-1], subset[1:]))
+
+        # the hotspot is split into smaller regions
+        first = [x for x in shards if x[0] == "chr1"][0]
+        assert first[2] - first[1] < 50_000
+
+        # same work in all regions of chr1 (chr2 is smaller than one region)
+        weights = regions.get_regions_work(shards, work)
+        assert len(weights) == len(shards)
+        weights = [w for w, x in zip(weights, shards) if x[0] == "chr1"]
+        assert max(weights) / min(weights) < 1.01
+
+        names = regions.write_regions(regions.pack_regions(shards, 0), wk + "/regions")
+        assert len(names) == len(shards)
+        assert os.path.exists(wk + "/regions/data.chr2.region.1.bed")
+        assert regions.read_regions(wk + "/regions") == names
+
+
+def test_cram_work():
+    contigs = [("chr1", 200_000), ("chr2", 50_000)]
+    positions = [("chr1", i % 20_000) for i in range(0, 20_000 * 20, 7)]
+    positions += [("chr1", i) for i in range(20_000, 199_000, 500)]
+    positions += [("chr2", i) for i in range(0, 49_000, 500)]
+
+    with tempfile.TemporaryDirectory() as wk:
+        with open(f"{wk}/ref.fa", "w") as fout:
+            for name, length in contigs:
+                fout.write(f">{name}\n" + "ACGT" * (length // 4) + "\n")
+        create_bam(f"{wk}/test.bam", contigs, positions)
+        cram = f"{wk}/test.cram"
+        pysam.view("-C", "-T", f"{wk}/ref.fa", "-o", cram, f"{wk}/test.bam", catch_stdout=False)
+        pysam.index(cram)
+
+        slices = regions.read_crai(cram + ".crai")
+        assert {x[0] for x in slices} == {0, 1}
+
+        work = regions.get_cram_work(cram, contigs)
+        assert [len(work[name]) for name, _ in contigs] == [13, 4]
+        assert work["chr1"][:2].sum() > work["chr1"][2:].sum()
+        assert round(sum(x.sum() for x in work.values())) == sum(x[3] for x in slices)
+
+
+def test_read_fai():
+    with tempfile.TemporaryDirectory() as wk:
+        with open(wk + "/ref.fa.fai", "w") as fout:
+            fout.write("chr1\t2500\t6\t60\t61\nchr2\t1000\t2600\t60\t61\n")
+        assert regions.read_fai(wk + "/ref.fa.fai") == [("chr1", 2500), ("chr2", 1000)]
+
+
+def test_reference_length():
+    with tempfile.TemporaryDirectory() as wk:
+        with open(wk + "/ref.fa", "w") as fout:
+            fout.write(">chr1 desc\nACGT\nAC\n>chr2\r\nAAA\r\n>empty\n\n>chr3\nA")
+        # bytes of the sequences are counted whatever the chunk size
+        for chunksize in (1, 3, 100):
+            assert regions.get_reference_length(wk + "/ref.fa", chunksize=chunksize) == 10
+
+        # the FASTA index is used when available
+        with open(wk + "/ref.fa.fai", "w") as fout:
+            fout.write("chr1\t2500\t6\t60\t61\nchr2\t1000\t2600\t60\t61\n")
+        assert regions.get_reference_length(wk + "/ref.fa") == 3500
+
+
+def test_pack_regions():
+    contigs = [("chr1", 2500)] + [(f"ctg{i}", 300) for i in range(10)]
+    shards = regions.pack_regions(regions.get_fixed_regions(contigs, 1000), 1000)
+
+    # the last chunk of chr1 is packed with the first small contigs
+    assert shards[0] == [("chr1", 0, 1000)]
+    assert shards[2] == [("chr1", 2000, 2500), ("ctg0", 0, 300)]
+    assert [len(x) for x in shards] == [1, 1, 2, 3, 3, 3]
+    assert all(sum(e - s for _, s, e in shard) <= 1000 for shard in shards)
+
+    with tempfile.TemporaryDirectory() as wk:
+        names = regions.write_regions(shards, wk)
+        assert names[2] == "data.chr1.region.3"
+        with open(f"{wk}/data.ctg1.region.1.bed") as fin:
+            assert fin.read() == "ctg1\t0\t300\nctg2\t0\t300\nctg3\t0\t300\n"
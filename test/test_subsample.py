@@ -0,0 +1,44 @@
+import gzip
+import tempfile
+
+from sequana_pipelines.variant_calling.subsample import (
+    get_subsample_name,
+    sample_records,
+    subsample_file,
+)
+
+
+def write_fastq(filename, names):
+    with gzip.open(filename, "wt") as fout:
+        for name in names:
+            fout.write(f"@{name}\nACGT\n+\nIIII\n")
+
+
+def read_names(filename):
+    with gzip.open(filename, "rt") as fin:
+        return [line[1:].split("/")[0] for i, line in enumerate(fin) if i % 4 == 0]
+
+
+def test_sample_records():
+    records = list(range(10000))
+    subsample = list(sample_records(records, 100, seed=1))
+    assert len(subsample) == 100 and subsample == sorted(subsample)
+    assert subsample == list(sample_records(records, 100, seed=1))
+    assert subsample != list(sample_records(records, 100, seed=2))
+    assert list(sample_records(records[:50], 100)) == records[:50]
+    assert 800 < len(list(sample_records(records, 0.1, seed=1))) < 1200
+
+
+def test_subsample_file():
+    with tempfile.TemporaryDirectory() as wk:
+        names = [f"read{i}" for i in range(1000)]
+        write_fastq(f"{wk}/A_R1_.fastq.gz", [f"{x}/1" for x in names])
+        write_fastq(f"{wk}/A_R2_.fastq.gz", [f"{x}/2" for x in names])
+
+        r1 = get_subsample_name(f"{wk}/A_R1_.fastq.gz", wk)
+        r2 = get_subsample_name(f"{wk}/A_R2_.fastq.gz", wk)
+        assert r1 == f"{wk}/A_R1_.subsampled.fastq.gz"
+        assert subsample_file(f"{wk}/A_R1_.fastq.gz", r1, 50, seed=3) == 50
+        assert subsample_file(f"{wk}/A_R2_.fastq.gz", r2, 50, seed=3) == 50
+        # same pairs in both files
+        assert read_names(r1) == read_names(r2)
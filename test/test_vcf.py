@@ -0,0 +1,143 @@
+import os
+import tempfile
+
+import pandas as pd
+import pysam
+from click.testing import CliRunner
+
+from sequana_pipelines.variant_calling import refilter
+from sequana_pipelines.variant_calling.vcf import (
+    FILTER_DEFAULTS,
+    VariantTable,
+    compress_vcf,
+    count_variants,
+    filter_vcf,
+    get_variant_stats,
+    merge_variant_stats,
+    write_variant_stats,
+)
+
+from .test_gvcf import SAMPLE_A, SAMPLE_B, write_gvcf
+
+
+def test_compressed_vcf():
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/data.vcf", "A", SAMPLE_A[1:2] + SAMPLE_B[1:])
+        assert count_variants(f"{wk}/data.vcf") == 2
+
+        compress_vcf(f"{wk}/data.vcf", f"{wk}/data.vcf.gz")
+        assert not os.path.exists(f"{wk}/data.vcf")
+        assert os.path.exists(f"{wk}/data.vcf.gz.tbi")
+        assert count_variants(f"{wk}/data.vcf.gz") == 2
+
+        # filtered variants are compressed and indexed as well
+        filter_vcf(f"{wk}/data.vcf.gz", f"{wk}/filter.vcf.gz", {"min_depth": 25}, output_csv=f"{wk}/filter.csv")
+        assert os.path.exists(f"{wk}/filter.csv")
+        with pysam.VariantFile(f"{wk}/filter.vcf.gz") as vcf:
+            assert [x.pos for x in vcf.fetch("chr1", 0, 1000)] == [100]
+
+        # plain files are kept as is
+        filter_vcf(f"{wk}/data.vcf.gz", f"{wk}/filter.vcf", {"min_depth": 10})
+        assert count_variants(f"{wk}/filter.vcf") == 2
+
+
+def test_variant_table():
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/data.vcf", "A", SAMPLE_A[1:2] + SAMPLE_B[1:])
+        table = VariantTable.from_vcf(f"{wk}/data.vcf")
+        table.save(f"{wk}/data.table.pkl")
+
+        table = VariantTable.load(f"{wk}/data.table.pkl")
+        assert len(table) == 2 and not table.is_joint
+        assert table.get_mask({"min_depth": 25}).tolist() == [True, False]
+
+        # variants of capped regions are flagged in the CSV file
+        table.flag_regions(
+            [("chr1", 50, 150, "skip_coverage"), ("chr1", 0, 1000, "limit_coverage"), ("chr1", 0, 1000, "split")]
+        )
+        table.filter({}, f"{wk}/flag.vcf", output_csv=f"{wk}/flag.csv")
+        df = pd.read_csv(f"{wk}/flag.csv", comment="#")
+        assert df["capped_region"].tolist() == ["skip_coverage", "limit_coverage"]
+
+        # same columns without variant (genotype columns are not saved)
+        assert table.filter({"min_depth": 1000}, f"{wk}/empty.vcf", output_csv=f"{wk}/empty.csv") == 0
+        empty = pd.read_csv(f"{wk}/empty.csv", comment="#")
+        assert empty.empty and list(empty.columns) == list(df.columns)
+        assert not set(table.samples) & set(df.columns)
+
+
+def test_variant_table_sequana():
+    # same variants as the filter of sequana (low frequency, strand bias,
+    # polymorphic and low score variants)
+    from sequana.freebayes_vcf_filter import VCF_freebayes
+
+    lines = (
+        SAMPLE_A[1:2]
+        + SAMPLE_B[1:]
+        + [
+            "chr1\t600\t.\tT\tC\t40\t.\tDP=40;RO=36;AO=4;SRF=18;SRR=18;SAF=4;SAR=0;TYPE=snp\tGT:DP:RO:AO\t0:40:36:4",
+            "chr1\t700\t.\tA\tG,T\t90\t.\tDP=30;RO=2;AO=20,8;SRF=1;SRR=1;SAF=10,4;SAR=10,4;TYPE=snp,snp\tGT:DP:RO:AO\t1:30:2:20,8",
+            "chr1\t800\t.\tG\tGA\t15\t.\tDP=12;RO=4;AO=8;SRF=2;SRR=2;SAF=6;SAR=2;TYPE=ins\tGT:DP:RO:AO\t1:12:4:8",
+        ]
+    )
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/data.vcf", "A", lines)
+        table = VariantTable.from_vcf(f"{wk}/data.vcf")
+
+        for params in (
+            {},
+            {"min_depth": 25},
+            {"keep_polymorphic": False},
+            {"frequency": 0.05, "strand_ratio": 0, "freebayes_score": 10},
+        ):
+            params = dict(FILTER_DEFAULTS, **params)
+            expected = VCF_freebayes(f"{wk}/data.vcf").filter_vcf(params).df.reset_index(drop=True)
+
+            df = table.df.loc[table.get_mask(params), expected.columns].reset_index(drop=True)
+            pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+            assert table.filter(params, f"{wk}/table.vcf") == len(expected)
+            with pysam.VariantFile(f"{wk}/table.vcf") as vcf:
+                assert [x.pos for x in vcf] == expected["position"].tolist()
+
+
+def test_refilter():
+    with tempfile.TemporaryDirectory() as wk:
+        os.makedirs(f"{wk}/A/freebayes_vcf_filter")
+        write_gvcf(f"{wk}/A/data.vcf", "A", SAMPLE_A[1:2] + SAMPLE_B[1:])
+        with open(f"{wk}/config.yaml", "w") as fout:
+            fout.write("general:\n  compressed_vcf: false\nfreebayes_vcf_filter:\n  min_depth: 25\n")
+
+        cwd = os.getcwd()
+        try:
+            os.chdir(wk)
+            VariantTable.from_vcf("A/data.vcf").save("A/freebayes_vcf_filter/A.table.pkl")
+            result = CliRunner().invoke(refilter.main, ["--working-directory", wk])
+        finally:
+            os.chdir(cwd)
+
+        assert result.exit_code == 0, result.output
+        assert count_variants(f"{wk}/A/freebayes_vcf_filter/A.filter.vcf") == 1
+        assert os.path.exists(f"{wk}/A/variant_calling.html")
+
+
+def test_variant_stats():
+    lines = SAMPLE_A[1:2] + [
+        "chr1\t200\t.\tAC\tGT\t50\t.\tDP=10;TYPE=mnp\tGT\t1",
+        "chr1\t300\t.\tA\tAT,G\t50\t.\tDP=10;TYPE=ins,snp\tGT\t1",
+        "chr1\t400\t.\tAT\tA\t50\t.\tDP=10\tGT\t1",
+    ]
+    with tempfile.TemporaryDirectory() as wk:
+        write_gvcf(f"{wk}/data.vcf", "A", lines)
+        stats = get_variant_stats(f"{wk}/data.vcf")
+        assert stats == {"variants": 4, "snp": 1, "mnp": 1, "indel": 1, "complex": 1}
+
+        write_variant_stats(f"{wk}/A.stats.csv", "A", 10, f"{wk}/data.vcf")
+        write_variant_stats(f"{wk}/B.stats.csv", "B", 5, f"{wk}/data.vcf")
+        merge_variant_stats([f"{wk}/B.stats.csv", f"{wk}/A.stats.csv"], f"{wk}/stats.csv")
+        with open(f"{wk}/stats.csv") as fin:
+            assert fin.read().split() == [
+                "name,raw,filter,snp,mnp,indel,complex",
+                "A,10,4,1,1,1,1",
+                "B,5,4,1,1,1,1",
+            ]